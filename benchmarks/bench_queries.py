@@ -0,0 +1,116 @@
+'''
+Measures report query latency on a synthetic rainbow.db, without and with the secondary indexes
+
+Usage: python benchmarks/bench_queries.py --players 50 --records 2000
+'''
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from r6siegetracker import R6Tracker
+from r6siegetracker.constants import OPERATOR_LIST, OPERATOR_STAT_LIST
+from r6siegetracker.track import STATS_COLUMNS, GUN_STATS_COLUMNS, STATS_INSERT, OPERATOR_STATS_INSERT, GUN_STATS_INSERT
+
+INDEXES = ['records_dt', 'players_name', 'stats_record', 'gun_stats_record']
+
+
+def populate(tracker, players, records, activity):
+    rng = random.Random(0)
+    cur = tracker.cursor
+    cur.executemany('INSERT INTO players (name, uplay_id, region) VALUES (?,?,?);',
+                    [('Player{}'.format(i), 'uplay-{}'.format(i), 'ncsa') for i in range(players)])
+    start = datetime.datetime(2019, 1, 1)
+    totals = [[0] * max(len(STATS_COLUMNS), len(GUN_STATS_COLUMNS)) for i in range(players)]
+    op_totals = [{} for i in range(players)]
+    for r in range(records):
+        dt = start + datetime.timedelta(hours=4 * r, minutes=rng.randint(0, 200), microseconds=rng.randint(1, 999999))
+        cur.execute('INSERT INTO records (dt) VALUES (?);', (str(dt),))
+        record_id = cur.lastrowid
+        stats, ops, guns = [], [], []
+        for p in range(players):
+            if r > 0 and rng.random() > activity:
+                continue
+            totals[p] = [v + rng.randint(0, 3) for v in totals[p]]
+            progress = [2500 + rng.randint(-50, 50), 2600, 25.0, 5.0, 10, 11, totals[p][0], totals[p][1]]
+            stats.append([p + 1, record_id] + totals[p][:len(STATS_COLUMNS) - 2 - len(progress)] + progress)
+            # Every session is played with a couple of operators
+            for op in rng.sample(OPERATOR_LIST, 2):
+                values = [v + rng.randint(1, 3) for v in op_totals[p].get(op[2], [0] * len(OPERATOR_STAT_LIST))]
+                op_totals[p][op[2]] = values
+                ops.append([p + 1, record_id, op[2]] + values)
+            guns.append([p + 1, record_id] + totals[p][:len(GUN_STATS_COLUMNS) - 2])
+        cur.executemany(STATS_INSERT, stats)
+        cur.executemany(OPERATOR_STATS_INSERT, ops)
+        cur.executemany(GUN_STATS_INSERT, guns)
+    tracker.backfill_latest_stats()
+    tracker.db.commit()
+    tracker.backfill_rollups()
+
+
+def measure(tracker, repeat):
+    name = 'Player7'
+    last = datetime.datetime.strptime(tracker.custom_query('SELECT MAX(dt) FROM records;')[0][0], '%Y-%m-%d %H:%M:%S.%f')
+    end_dt = str(last)
+    month_ago = str(last - datetime.timedelta(days=30))
+    players = tracker.get_all_players()
+    queries = [
+        ('get_user_info', lambda: tracker.get_user_info(name, 'mmr')),
+        ('get_last_records', tracker.get_last_records),
+        ('is_save_required (SQL part)', lambda: tracker.is_save_required(players, [0] * len(players))),
+        ('progress Ranked, all records', lambda: tracker.get_player_progress(name, end_dt=end_dt, summary_type='Cumulative', printStats=False)),
+        ('progress Ranked, daily', lambda: tracker.get_player_progress(name, end_dt=end_dt, summary_type='Cumulative', increment=1, printStats=False)),
+        ('progress Gun, weekly', lambda: tracker.get_player_progress(name, end_dt=end_dt, stype='Gun', increment=7, printStats=False)),
+        ('progress Operator, last 30 days', lambda: tracker.get_player_progress(name, start_dt=month_ago, end_dt=end_dt, stype='Operator', increment=1, printStats=False)),
+        ]
+    results = {}
+    for label, func in queries:
+        best = None
+        for i in range(repeat):
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[label] = best
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--players', type=int, default=50)
+    parser.add_argument('--records', type=int, default=2000)
+    parser.add_argument('--activity', type=float, default=0.3, help='ratio of players saved in each record')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='r6bench_')
+    os.chdir(workdir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracker = R6Tracker(None)
+    print('Building {} players x {} records in {}'.format(args.players, args.records, workdir))
+    populate(tracker, args.players, args.records, args.activity)
+    tracker.cursor.execute('SELECT COUNT(*) FROM stats;')
+    print('{} stats rows'.format(tracker.cursor.fetchone()[0]))
+
+    for index in INDEXES:
+        tracker.cursor.execute('DROP INDEX IF EXISTS {};'.format(index))
+    tracker.cursor.execute('ANALYZE;')
+    before = measure(tracker, args.repeat)
+    tracker.create_indexes()
+    tracker.cursor.execute('ANALYZE;')
+    after = measure(tracker, args.repeat)
+
+    print('{:<34} {:>12} {:>12}'.format('Query', 'no index', 'indexed'))
+    for label in before:
+        print('{:<34} {:>10.1f}ms {:>10.1f}ms'.format(label, before[label] * 1000, after[label] * 1000))
+
+
+if __name__ == '__main__':
+    main()
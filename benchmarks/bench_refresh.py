@@ -0,0 +1,62 @@
+'''
+Measures save_state and save_season_stats throughput against the offline UbiSimulator
+
+Usage: python benchmarks/bench_refresh.py --players 20000 --latency 0.05 --active 0.05
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from r6siegetracker import UbiConnection, R6Tracker
+from r6siegetracker.simulate import UbiSimulator
+
+
+def timed(label, func, sim):
+    before = dict(sim.requests)
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    requests = {k: v - before.get(k, 0) for k, v in sim.requests.items() if v - before.get(k, 0)}
+    print('{:<32} {:>9.3f} s   requests: {}'.format(label, elapsed, requests))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--players', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per request')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=0, help='requests per second, 0 for no limit')
+    parser.add_argument('--active', type=float, default=0.05, help='ratio of players with new games per poll')
+    parser.add_argument('--polls', type=int, default=3)
+    parser.add_argument('--seasons', action='store_true', help='also measure save_season_stats')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='r6bench_')
+    os.chdir(workdir)
+    rate_limit = (args.rate_limit, args.rate_limit) if args.rate_limit else None
+    sim = UbiSimulator(players=args.players, latency=args.latency, error_rate=args.error_rate, rate_limit=rate_limit)
+    UbiConnection.encrypt_to_file('bench@example.com', 'bench', '')
+    u = UbiConnection(transport=sim, rate_limits={})
+    tracker = R6Tracker(u)
+    tracker.cursor.executemany('INSERT INTO players (name, uplay_id, region) VALUES (?,?,?);',
+                               [('Player{}'.format(i), id, 'ncsa') for i, id in enumerate(sim.ids)])
+    tracker.db.commit()
+    print('Working directory: {}'.format(workdir))
+    print('{} players, {:.0f} ms latency, {:.1%} errors, {:.0%} active per poll'.format(
+        args.players, args.latency * 1000, args.error_rate, args.active))
+
+    timed('save_state (initial)', tracker.save_state, sim)
+    for poll in range(args.polls):
+        sim.play(args.active)
+        timed('save_state (poll {})'.format(poll + 1), tracker.save_state, sim)
+    timed('save_state (no changes)', tracker.save_state, sim)
+    if args.seasons:
+        timed('save_season_stats', tracker.save_season_stats, sim)
+
+
+if __name__ == '__main__':
+    main()
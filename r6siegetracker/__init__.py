@@ -1,3 +1,4 @@
-from r6siegetracker.connect import UbiConnection
+from r6siegetracker.connect import UbiConnection, AsyncUbiConnection
 from r6siegetracker.track import R6Tracker
+from r6siegetracker.cache import ResponseCache
 from r6siegetracker.constants import *
\ No newline at end of file
@@ -0,0 +1,98 @@
+import json
+import sqlite3
+import threading
+import time
+from r6siegetracker.constants import CACHE_TTL
+
+
+class ResponseCache:
+    '''
+    ResponseCache stores API responses on disk keyed by URL
+    Every endpoint family has its own time-to-live (in seconds), families without a TTL are not cached
+    The least recently used entries are evicted when the cache grows over max_entries
+    Lookups do not commit, their access times and deletions are written with the next put, clear or close
+    '''
+
+    def __init__(self, filename='cache.db', ttl=None, max_entries=10000):
+        self.ttl = dict(CACHE_TTL)
+        if ttl is not None:
+            self.ttl.update(ttl)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS
+                           responses(url TEXT PRIMARY KEY,
+                                     family VARCHAR(20),
+                                     created FLOAT,
+                                     accessed FLOAT,
+                                     body TEXT)
+                        ''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed);')
+        self.db.commit()
+        self.size = self.db.execute('SELECT COUNT(*) FROM responses;').fetchone()[0]
+
+    '''
+    Returns the cached response of the url, or None if it is missing or expired
+    '''
+    def get(self, url, family):
+        ttl = self.ttl.get(family, 0)
+        if ttl <= 0:
+            return None
+        now = time.time()
+        with self.lock:
+            row = self.db.execute('SELECT created, body FROM responses WHERE url = ?;', (url,)).fetchone()
+            if row is None or now - row[0] > ttl:
+                if row is not None:
+                    self.db.execute('DELETE FROM responses WHERE url = ?;', (url,))
+                    self.size -= 1
+                self.misses += 1
+                return None
+            self.db.execute('UPDATE responses SET accessed = ? WHERE url = ?;', (now, url))
+            self.hits += 1
+        return json.loads(row[1])
+
+    '''
+    Stores a response, evicts the least recently used entries over the size cap
+    '''
+    def put(self, url, family, data):
+        if self.ttl.get(family, 0) <= 0:
+            return
+        now = time.time()
+        with self.lock:
+            cur = self.db.execute('INSERT OR REPLACE INTO responses (url, family, created, accessed, body) VALUES (?, ?, ?, ?, ?);',
+                                  (url, family, now, now, json.dumps(data)))
+            self.size = self.db.execute('SELECT COUNT(*) FROM responses;').fetchone()[0]
+            if self.size > self.max_entries:
+                self.db.execute('DELETE FROM responses WHERE url IN (SELECT url FROM responses ORDER BY accessed ASC LIMIT ?);',
+                                (self.size - self.max_entries,))
+                self.size = self.max_entries
+            self.db.commit()
+
+    '''
+    Removes all entries, or only the entries of the given endpoint family
+    '''
+    def clear(self, family=None):
+        with self.lock:
+            if family is None:
+                self.db.execute('DELETE FROM responses;')
+            else:
+                self.db.execute('DELETE FROM responses WHERE family = ?;', (family,))
+            self.db.commit()
+            self.size = self.db.execute('SELECT COUNT(*) FROM responses;').fetchone()[0]
+
+    '''
+    Returns hit / miss counters and the number of stored entries
+    '''
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': self.size}
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
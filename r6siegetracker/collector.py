@@ -0,0 +1,162 @@
+import argparse
+import queue
+import signal
+import threading
+import time
+from r6siegetracker.connect import UbiConnection
+from r6siegetracker.track import R6Tracker
+from r6siegetracker.scheduler import PollScheduler
+from r6siegetracker.constants import COLLECTOR_INTERVAL
+
+
+class Collector:
+    '''
+    Collector keeps one UbiConnection and one R6Tracker open and saves the state of all players every `interval` seconds
+    Records are written by a writer thread, so the stats of the next cycle are fetched while the last ones are written
+    Runs which are due while a cycle is still fetching are skipped instead of piling up
+    With a PollScheduler only the players which are due are checked in each cycle
+
+    Usage: Collector(R6Tracker(UbiConnection(master_password))).run()
+       or: python -m r6siegetracker.collector --interval 300
+    '''
+
+    def __init__(self, tracker, interval=COLLECTOR_INTERVAL, verbose=False, scheduler=None):
+        self.tracker = tracker
+        self.scheduler = scheduler
+        self.interval = interval
+        self.verbose = verbose
+        # At most one cycle waits for the writer, the fetch of the following cycle waits for a free slot
+        self.writes = queue.Queue(maxsize=1)
+        # Match counts of the entries which are fetched but not written yet, by player id
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.writer = None
+        self.cycles = 0
+        self.skipped = 0
+
+    '''
+    Starts the writer thread and polls until stop is called, SIGINT or SIGTERM is received or `cycles` cycles have run
+    '''
+    def run(self, cycles=None):
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, self.handle_signal)
+        self.writer = threading.Thread(target=self.write_loop, name='collector-writer', daemon=True)
+        self.writer.start()
+        print('INFO: Collector started, polling every {} seconds.'.format(self.interval))
+        next_run = time.monotonic()
+        try:
+            while not self.stopping.is_set():
+                self.cycle()
+                if cycles is not None and self.cycles >= cycles:
+                    break
+                next_run += self.interval
+                now = time.monotonic()
+                if now > next_run:
+                    # The cycle took longer than the interval, the missed runs are not repeated
+                    missed = int((now - next_run) // self.interval) + 1
+                    self.skipped += missed
+                    print('WARNING: Cycle {} took longer than the interval, skipped {} run(s).'.format(self.cycles, missed))
+                    next_run += missed * self.interval
+                self.stopping.wait(next_run - time.monotonic())
+        finally:
+            self.shutdown()
+
+    '''
+    Fetches the stats of the players with new games and hands them to the writer thread
+    '''
+    def cycle(self):
+        self.cycles += 1
+        start = time.perf_counter()
+        with self.pending_lock:
+            pending = dict(self.pending)
+        players = None
+        if self.scheduler is not None:
+            players = self.scheduler.due()
+            if not players:
+                print('INFO: Cycle {} has no players due.'.format(self.cycles))
+                return
+        try:
+            entries = self.tracker.prepare_state(pending=pending, players=players)
+            if players is not None:
+                self.scheduler.polled(players)
+        except Exception as e:
+            print('ERROR: Cycle {} could not fetch the stats: {}'.format(self.cycles, e))
+            return
+        elapsed = time.perf_counter() - start
+        if entries is None:
+            print('INFO: Cycle {} fetched no updates in {:.3f} s.'.format(self.cycles, elapsed))
+            return
+        with self.pending_lock:
+            for player, stats, *entry in entries:
+                self.pending[player['id']] = stats.get('generalpvp_matchplayed:infinite', 0)
+        print('INFO: Cycle {} fetched {} player(s) in {:.3f} s.'.format(self.cycles, len(entries), elapsed))
+        self.writes.put((self.cycles, entries))
+
+    '''
+    Writes the fetched entries in the order they were fetched, None stops the thread
+    '''
+    def write_loop(self):
+        while True:
+            item = self.writes.get()
+            if item is None:
+                self.writes.task_done()
+                return
+            cycle, entries = item
+            start = time.perf_counter()
+            try:
+                record_id = self.tracker.write_state(entries, self.verbose)
+                print('INFO: Cycle {} wrote record {} in {:.3f} s.'.format(cycle, record_id, time.perf_counter() - start))
+            except Exception as e:
+                print('ERROR: Cycle {} could not write the stats: {}'.format(cycle, e))
+            finally:
+                # Written or not, the next cycles compare with the DB again, unless a newer entry is still queued
+                with self.pending_lock:
+                    for player, stats, *entry in entries:
+                        if self.pending.get(player['id']) == stats.get('generalpvp_matchplayed:infinite', 0):
+                            del self.pending[player['id']]
+                self.writes.task_done()
+
+    '''
+    Stops the collector after the running cycle
+    '''
+    def stop(self):
+        self.stopping.set()
+
+    def handle_signal(self, signum, frame):
+        print('INFO: Received signal {}, stopping after the running cycle...'.format(signum))
+        self.stop()
+
+    '''
+    Waits for the queued writes and closes the tracker and the connection
+    '''
+    def shutdown(self):
+        if self.writer is not None:
+            self.writes.put(None)
+            self.writer.join()
+            self.writer = None
+        self.tracker.readers.close()
+        self.tracker.db.close()
+        if self.tracker.u is not None:
+            self.tracker.u.close()
+        print('INFO: Collector stopped after {} cycle(s), {} run(s) skipped.'.format(self.cycles, self.skipped))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Saves the stats of all tracked players on a schedule')
+    parser.add_argument('--interval', type=float, default=COLLECTOR_INTERVAL, help='seconds between two polls')
+    parser.add_argument('--cycles', type=int, default=None, help='stop after this many polls')
+    parser.add_argument('--master-password', default=None, help='master password of login.txt')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='requests per hour, polls players by their activity instead of all of them')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    tracker = R6Tracker(UbiConnection(args.master_password))
+    scheduler = PollScheduler(tracker, budget=args.budget) if args.budget else None
+    Collector(tracker, interval=args.interval, verbose=args.verbose, scheduler=scheduler).run(args.cycles)
+
+
+if __name__ == '__main__':
+    main()
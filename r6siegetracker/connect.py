@@ -1,18 +1,52 @@
 from r6siegetracker.constants import *
+from r6siegetracker.cache import ResponseCache
+from r6siegetracker.ratelimit import RateLimiter, backoff_delay
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 import json
 import pprint
 import os.path
+import threading
+import time
+import datetime
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 class UbiConnection:
     '''
     UbiConnection provides functionality to connect Ubisoft servers and pull stats data
     '''
 
-    def __init__(self, master_password=None):
+    # Pool shared by validate calls, which run without an instance
+    _shared_http = None
+    _shared_http_lock = threading.Lock()
+
+    def __init__(self, master_password=None, pool_size=10, max_ids_per_request=MAX_IDS_PER_REQUEST, cache=None,
+                 rate_limits=None, max_retries=MAX_RETRIES, transport=None):
 
         self.connected = False
+        # Keep-alive connection pool, safe to share between threads
+        # transport replaces the HTTP session, e.g. with simulate.UbiSimulator for offline use
+        self.pool_size = pool_size
+        if transport is None:
+            transport = UbiConnection.create_http_session(pool_size)
+        self.http = transport
+        # Large populations are split into chunks which are requested in parallel
+        self.max_ids_per_request = max_ids_per_request
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+        # Optional on-disk response cache, pass True for the default ResponseCache
+        if cache is True:
+            cache = ResponseCache()
+        self.cache = cache
+        # Request budget per endpoint family and retries for throttled requests
+        # rate_limits replaces RATE_LIMITS, families left out of it are not throttled
+        self.limiter = RateLimiter(rate_limits)
+        self.max_retries = max_retries
+        # Ticket expiration (UTC), re-logins are serialized so only one request renews the ticket
+        self.expiration = None
+        self.login_lock = threading.Lock()
 
         if not os.path.exists('login.txt'):
             raise Exception('You need to have login.txt in the directory, use UbiConnection.encrypt_to_file function')
@@ -28,7 +62,11 @@ class UbiConnection:
         # Session information
         if os.path.exists('info.txt'):
             self.read_ticket()
-            if not self.get_stats():
+            if self.expiration is None:
+                # Unknown expiration, validate the ticket with a request
+                if not self.get_stats():
+                    self.login()
+            elif self.ticket_expires_soon():
                 self.login()
         else:
             self.login()
@@ -86,35 +124,45 @@ class UbiConnection:
     '''
     @classmethod
     def validate(cls, username, password):
-        HEADERS = {
-            'Ubi-AppId': UBI_APP_ID,
-            'Content-Type': 'application/json; charset=UTF-8',
-            'User-Agent': 'Mozilla/5.0',
-            'Ubi-LocaleCode': 'en-US',
-            'Accept-Language': 'en-US,en;q=0.9'
-        }
         payload = {'rememberMe': 'true'}
-        r = requests.post(LOGIN_URL, headers=HEADERS, auth=HTTPBasicAuth(username, password), json=payload)
+        r = cls.shared_http_session().post(LOGIN_URL, auth=HTTPBasicAuth(username, password), json=payload)
         if r.status_code == 200:
             return True
         else:
             return False
 
+    '''
+    Creates a requests session with a keep-alive connection pool and the default Ubisoft headers
+    '''
+    @classmethod
+    def create_http_session(cls, pool_size=10):
+        http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        http.mount('https://', adapter)
+        http.mount('http://', adapter)
+        http.headers.update(UBI_HEADERS)
+        return http
+
+    '''
+    Returns the connection pool used by class-level requests
+    '''
+    @classmethod
+    def shared_http_session(cls):
+        with cls._shared_http_lock:
+            if cls._shared_http is None:
+                cls._shared_http = cls.create_http_session()
+            return cls._shared_http
+
     '''
     Creates a ubisoft session and records the ticket
     '''
     def login(self):
-        HEADERS = {
-            'Ubi-AppId': UBI_APP_ID,
-            'Content-Type': 'application/json; charset=UTF-8',
-            'User-Agent': 'Mozilla/5.0',
-            'Ubi-LocaleCode': 'en-US',
-            'Accept-Language': 'en-US,en;q=0.9'
-        }
         payload = {'rememberMe': 'true'}
-        r = requests.post(LOGIN_URL, headers=HEADERS, auth=HTTPBasicAuth(self.SECRET_USERNAME, self.SECRET_PASSWORD), json=payload)
+        self.limiter.acquire('login')
+        r = self.http.post(LOGIN_URL, auth=HTTPBasicAuth(self.SECRET_USERNAME, self.SECRET_PASSWORD), json=payload)
         if r.status_code == 200:
             self.session = json.loads(r.text)
+            self.expiration = parse_expiration(self.session)
             f = open('info.txt', 'w')
             json.dump(r.json(), f)
             f.close()
@@ -136,36 +184,85 @@ class UbiConnection:
     def read_ticket(self):
         f = open('info.txt', 'r')
         self.session = json.load(f)
+        f.close()
+        self.expiration = parse_expiration(self.session)
         self.connected = True
 
+    '''
+    Returns True if the ticket expires within TICKET_REFRESH_MARGIN seconds
+    '''
+    def ticket_expires_soon(self):
+        if self.expiration is None:
+            return False
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return now + datetime.timedelta(seconds=TICKET_REFRESH_MARGIN) >= self.expiration
+
+    '''
+    Renews the ticket, concurrent callers wait for a single login
+    ticket is the ticket the caller has used, nothing is done if it has already been replaced
+    '''
+    def refresh_ticket(self, ticket=None):
+        with self.login_lock:
+            if ticket is not None and self.session.get('ticket') != ticket:
+                return self.connected
+            return self.login()
+
     '''
     Creates HTTP requests and parses results as dictionary
+    With cached=False the response cache is neither read nor written
     '''
-    def get(self, url, params={}, force=True):
-        headers = {
-            'Ubi-AppId': UBI_APP_ID,
-            'Content-Type': 'application/json; charset=UTF-8',
-            'User-Agent': 'Mozilla/5.0',
-            'Ubi-LocaleCode': 'en-US',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Authorization': 'Ubi_v1 t=' + self.session['ticket'],
-            'ubi-sessionid': self.session['sessionId']
-            }
-        for key, value in params.values():
-            headers[key] = value
-        r = requests.get(url, headers=headers)
-        if r.status_code == 200:
-            return json.loads(r.text)
-            print(r)
-        else:
-            # Try logging in and send request again
-            if force:
-                print('WARNING: Connection failed (possibly expired), renewing connection to server.')
-                self.login()
-                r = self.get(url, params, force=False)
-                return r
+    def get(self, url, params={}, force=True, cached=True):
+        family = endpoint_family(url)
+        if self.cache is not None and cached:
+            r_dict = self.cache.get(url, family)
+            if r_dict is not None:
+                return r_dict
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(family)
+            ticket = self.session['ticket']
+            if self.ticket_expires_soon():
+                self.refresh_ticket(ticket)
+                ticket = self.session['ticket']
+            # Default headers are set on the pooled session, only the ticket is added per request
+            headers = {
+                'Authorization': 'Ubi_v1 t=' + ticket,
+                'ubi-sessionid': self.session['sessionId']
+                }
+            for key, value in params.items():
+                headers[key] = value
+            try:
+                r = self.http.get(url, headers=headers)
+            except requests.exceptions.RequestException as e:
+                print('WARNING: Request failed ({}).'.format(e))
+                r = None
+            if r is not None and r.status_code == 200:
+                r_dict = json.loads(r.text)
+                if self.cache is not None and cached:
+                    self.cache.put(url, family, r_dict)
+                return r_dict
+            elif r is not None and r.status_code == 401:
+                # Ticket expired, log in and send request again
+                if force:
+                    print('WARNING: Connection failed (possibly expired), renewing connection to server.')
+                    self.refresh_ticket(ticket)
+                    return self.get(url, params, force=False, cached=cached)
+                else:
+                    return None
+            elif r is None or r.status_code == 429 or r.status_code >= 500:
+                # Throttled or server error, wait and retry
+                if attempt == self.max_retries:
+                    break
+                delay = backoff_delay(attempt, None if r is None else r.headers.get('Retry-After'))
+                print('WARNING: Request failed ({}), retrying in {:.1f} seconds.'.format('no response' if r is None else r.status_code, delay))
+                # On 429 every request of the family is held back and the limiter waits before the retry
+                # Server errors and families without a bucket wait here
+                if r is None or r.status_code != 429 or not self.limiter.pause(family, delay):
+                    time.sleep(delay)
             else:
+                print('ERROR: Request failed with status {}.'.format(r.status_code))
                 return None
+        print('ERROR: Request failed after {} retries.'.format(self.max_retries))
+        return None
 
     '''
     Returns ID of the given player name
@@ -183,6 +280,27 @@ class UbiConnection:
         else:
             raise Exception('ERROR: Cannot get Uplay ID')
 
+    '''
+    Returns IDs of the given player names as a dictionary, names are requested in bulk
+    Names which do not exist in Uplay database are mapped to None
+    '''
+    def get_players_by_names(self, names):
+        size = self.max_ids_per_request
+        urls = [PLAYER_URL.format(key='nameOnPlatform', val=','.join(names[i:i+size])) for i in range(0, len(names), size)]
+        responses = list(self.executor.map(self.get, urls))
+        if not all(responses):
+            raise Exception('ERROR: Cannot get Uplay IDs')
+        found = {}
+        for r_dict in responses:
+            for p in r_dict['profiles']:
+                found[p['nameOnPlatform'].lower()] = p['profileId']
+        ids = {}
+        for name in names:
+            ids[name] = found.get(name.lower())
+            if ids[name] is None:
+                print('ERROR: No such name exists in Uplay database: {}'.format(name))
+        return ids
+
     def get_level(self):
         pass
 
@@ -204,27 +322,45 @@ class UbiConnection:
         else:
             raise Exception('ERROR: Cannot find ID')
 
+    '''
+    Requests an URL for a list of profile IDs, the IDs are split into chunks of max_ids_per_request
+    Chunks are requested in parallel and the `key` fields of the responses are merged into one dictionary
+    Returns None if any of the chunks fails
+    '''
+    def get_chunked(self, url, ids, key='results', cached=True, **kwargs):
+        size = self.max_ids_per_request
+        urls = [url.format(ids=','.join(ids[i:i+size]), **kwargs) for i in range(0, len(ids), size)]
+        get = functools.partial(self.get, cached=cached)
+        if len(urls) == 1:
+            responses = [get(urls[0])]
+        else:
+            responses = list(self.executor.map(get, urls))
+        if not all(responses):
+            return None
+        merged = {}
+        for r_dict in responses:
+            merged.update(r_dict[key])
+        return merged
+
     '''
     Returns stats of the requested user
     '''
     def get_stats(self, ids=None):
         if ids is None:
             ids = [self.session['userId']]
-        REQ_URL = STATS_URL.format(ids=','.join(ids))
-        r_dict = self.get(REQ_URL)
-        if r_dict:
-            return [r_dict['results'][id] for id in ids]
+        results = self.get_chunked(STATS_URL, ids)
+        if results is not None:
+            return [results[id] for id in ids]
         else:
-            print('ERROR: Cannot get player stats {}'.format(id))
+            print('ERROR: Cannot get player stats')
             return None
 
     def get_operator_stats(self, ids=None):
         if ids is None:
             ids = [self.session['userId']]
-        REQ_URL = OPERATOR_URL.format(ids=','.join(ids))
-        r_dict = self.get(REQ_URL)
-        if r_dict:
-            op_list = [r_dict['results'][id] for id in ids]
+        results = self.get_chunked(OPERATOR_URL, ids)
+        if results is not None:
+            op_list = [results[id] for id in ids]
             return op_list
         else:
             print('ERROR: Cannot get operator stats')
@@ -236,40 +372,74 @@ class UbiConnection:
     def get_gun_stats(self, ids=None):
         if ids is None:
             ids = [self.session['userId']]
-        REQ_URL = GUN_URL.format(ids=','.join(ids))
-        r_dict = self.get(REQ_URL)
-        if r_dict:
-            return [r_dict['results'][id] for id in ids]
+        results = self.get_chunked(GUN_URL, ids)
+        if results is not None:
+            return [results[id] for id in ids]
         else:
-            print('ERROR: Cannot get player stats {}'.format(id))
+            print('ERROR: Cannot get player stats')
+            return None
+
+    '''
+    Returns general, operator and gun stats of the requested users with a single request per chunk
+    The result is a tuple of three lists in the format of get_stats, get_operator_stats and get_gun_stats
+    '''
+    def get_all_stats(self, ids=None):
+        if ids is None:
+            ids = [self.session['userId']]
+        results = self.get_chunked(ALL_STATS_URL, ids)
+        if results is None:
+            print('ERROR: Cannot get player stats')
             return None
+        stats, ops, guns = [], [], []
+        for id in ids:
+            p_stat, p_op_stat, p_gun_stat = {}, {}, {}
+            for key, value in results[id].items():
+                if key.startswith('operatorpvp_'):
+                    p_op_stat[key] = value
+                elif key.startswith('weapontypepvp_'):
+                    p_gun_stat[key] = value
+                else:
+                    p_stat[key] = value
+            stats.append(p_stat)
+            ops.append(p_op_stat)
+            guns.append(p_gun_stat)
+        return stats, ops, guns
 
     '''
     Returns the matchmatking stats of the requested user
     '''
-    def get_rank(self, id=None, region='ncsa', season=-1): # Todo make ids, try with multiple seasons as well!
+    def get_rank(self, id=None, region='ncsa', season=-1):
         if id is None:
             id = self.session['userId']
-        REQ_URL = PROGRESS_URL.format(region=region, id=id, season=season)
-        r_dict = self.get(REQ_URL)
-        if r_dict:
-            return r_dict['players'][id]
+        return self.get_ranks([id], region=region, season=season).get(id)
+
+    '''
+    Returns the matchmaking stats of the requested users as a dictionary keyed by ID
+    Users missing from the response are left out, the dictionary is empty if the request fails
+    '''
+    def get_ranks(self, ids, region='ncsa', season=-1):
+        results = self.get_chunked(PROGRESS_URL, ids, key='players', region=region, season=season)
+        if results is not None:
+            ranks = {id: results.get(id) for id in ids}
+            missing = [id for id, rank in ranks.items() if rank is None]
+            if missing:
+                print('WARNING: No ranks in the response for {}.'.format(','.join(missing)))
+            return {id: rank for id, rank in ranks.items() if rank is not None}
         else:
-            print('ERROR: Cannot get player ranks {}.'.format(id))
-            return None
+            print('ERROR: Cannot get player ranks {}.'.format(','.join(ids)))
+            return {}
 
     '''
     Returns the total number of games played for each user
+    The match counts decide if a save is required, so they are always requested and never cached
     '''
     def get_total_games(self, ids):
-        total_games = []
-        REQ_URL = GAME_PLAYERD_URL.format(ids=','.join(ids))
-        r_dict = self.get(REQ_URL)
-        if r_dict:
+        results = self.get_chunked(GAME_PLAYERD_URL, ids, cached=False)
+        if results is not None:
             tgp_list = []
             for id in ids:
                 try:
-                    tgp_list.append(r_dict['results'][id]['generalpvp_matchplayed:infinite'])
+                    tgp_list.append(results[id]['generalpvp_matchplayed:infinite'])
                 except KeyError:
                     tgp_list.append(0)
             return tgp_list
@@ -277,8 +447,96 @@ class UbiConnection:
             print('ERROR: Cannot get total games played for requested users.')
             return None
 
+    '''
+    Closes the pooled connections
+    '''
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.http.close()
+        if self.cache is not None:
+            self.cache.close()
+
     '''
     Prints all fields in session
     '''
     def print_session(self):
         pprint.pprint(self.session)
+
+
+
+'''
+Returns the expiration time of a session as an UTC datetime, None if it is missing
+'''
+def parse_expiration(session):
+    try:
+        # e.g. 2020-04-05T15:21:33.7826311Z, fractions of seconds are ignored
+        expiration = datetime.datetime.strptime(session['expiration'].split('.')[0].rstrip('Z'), '%Y-%m-%dT%H:%M:%S')
+        return expiration.replace(tzinfo=datetime.timezone.utc)
+    except (KeyError, AttributeError, ValueError):
+        return None
+
+'''
+Returns the endpoint family (see ENDPOINT_FAMILIES) of a request URL
+'''
+def endpoint_family(url):
+    for family, prefix in ENDPOINT_FAMILIES:
+        if url.startswith(prefix):
+            return family
+    return None
+
+
+class AsyncUbiConnection:
+    '''
+    AsyncUbiConnection exposes UbiConnection requests as coroutines, requests run on the pooled
+    connections of the wrapped UbiConnection with at most `concurrency` of them in flight
+    '''
+
+    def __init__(self, ubiconnect, concurrency=None):
+        self.u = ubiconnect
+        if concurrency is None:
+            concurrency = ubiconnect.pool_size
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    '''
+    Runs a blocking UbiConnection call on the worker pool
+    '''
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def get_player_by_name(self, name):
+        return await self.run(self.u.get_player_by_name, name)
+
+    async def get_players_by_names(self, names):
+        return await self.run(self.u.get_players_by_names, names)
+
+    async def get_player_by_id(self, id):
+        return await self.run(self.u.get_player_by_id, id)
+
+    async def get_stats(self, ids=None):
+        return await self.run(self.u.get_stats, ids)
+
+    async def get_operator_stats(self, ids=None):
+        return await self.run(self.u.get_operator_stats, ids)
+
+    async def get_gun_stats(self, ids=None):
+        return await self.run(self.u.get_gun_stats, ids)
+
+    async def get_all_stats(self, ids=None):
+        return await self.run(self.u.get_all_stats, ids)
+
+    async def get_rank(self, id=None, region='ncsa', season=-1):
+        return await self.run(self.u.get_rank, id, region, season)
+
+    async def get_ranks(self, ids, region='ncsa', season=-1):
+        return await self.run(self.u.get_ranks, ids, region, season)
+
+    async def get_total_games(self, ids):
+        return await self.run(self.u.get_total_games, ids)
+
+    '''
+    Stops the worker pool, the wrapped UbiConnection stays open
+    '''
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -1,9 +1,34 @@
 # App constants
-DB_VERSION = 13
+DB_VERSION = 19
+MAX_IDS_PER_REQUEST = 100 # Profile IDs sent in a single populations / profile_ids query
+SQLITE_PRAGMAS = [
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -65536), # 64 MB
+    ('mmap_size', 268435456), # 256 MB
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000)
+    ]
+ROLLUP_PERIODS = ['day', 'week', 'season'] # Last record of every player is kept for these periods
+EXPORT_BATCH_SIZE = 1000 # Rows fetched at once by export_to_csv
+BACKUP_PAGES = 1024 # Pages copied in each step of export_to_db
+ALIAS_MAX_AGE = 30 # Days a name -> profile ID entry in aliases table is trusted
+COLLECTOR_INTERVAL = 300 # Seconds between two polls of the collector
+SCHEDULER_BUDGET = 360 # Requests per hour sent by the polls of PollScheduler (match counts, stats and ranks)
+SCHEDULER_HISTORY = 28 # Days of records PollScheduler learns the activity of players from
+SCHEDULER_MIN_PROBABILITY = 0.25 # Players are polled once a new game since their last poll is this likely
+SCHEDULER_MAX_AGE = 24 # Hours after which a player is polled whatever their activity
 
 
 # Constant fields
 UBI_APP_ID = '39baebad-39e5-4552-8c25-2c9b919064e2'
+UBI_HEADERS = {
+    'Ubi-AppId': UBI_APP_ID,
+    'Content-Type': 'application/json; charset=UTF-8',
+    'User-Agent': 'Mozilla/5.0',
+    'Ubi-LocaleCode': 'en-US',
+    'Accept-Language': 'en-US,en;q=0.9'
+    }
 GUN_LIST = [(1, 'ar', 'Assault Rifle', 'AR'),
             (2, 'smg', 'Submachine Gun', 'SMG'),
             (3, 'lmg', 'Light Machine Gun', 'LMG'),
@@ -119,12 +144,42 @@ PLAYER_URL = 'https://public-ubiservices.ubi.com/v2/profiles?platformType=uplay&
 STATS_URL = 'https://public-ubiservices.ubi.com/v1/spaces/5172a557-50b5-4665-b7db-e3f2e8c5041d/sandboxes/OSBOR_PC_LNCH_A/playerstats2/statistics?populations={ids}&' +\
             'statistics='+','.join(set(s[3] for s in STAT_LIST))
 PROFILE_PIC = 'https://ubisoft-avatars.akamaized.net/{id}/default_146_146.png?appId=39baebad-39e5-4552-8c25-2c9b919064e2'
-PROGRESS_URL = 'https://public-ubiservices.ubi.com/v1/spaces/5172a557-50b5-4665-b7db-e3f2e8c5041d/sandboxes/OSBOR_PC_LNCH_A/r6karma/players?board_id=pvp_ranked&region_id={region}&profile_ids={id}&season_id={season}'
+PROGRESS_URL = 'https://public-ubiservices.ubi.com/v1/spaces/5172a557-50b5-4665-b7db-e3f2e8c5041d/sandboxes/OSBOR_PC_LNCH_A/r6karma/players?board_id=pvp_ranked&region_id={region}&profile_ids={ids}&season_id={season}'
 GAME_PLAYERD_URL = 'https://public-ubiservices.ubi.com/v1/spaces/5172a557-50b5-4665-b7db-e3f2e8c5041d/sandboxes/OSBOR_PC_LNCH_A/playerstats2/statistics?populations={ids}&statistics=generalpvp_matchplayed'
 OPERATOR_URL = 'https://public-ubiservices.ubi.com/v1/spaces/5172a557-50b5-4665-b7db-e3f2e8c5041d/sandboxes/OSBOR_PC_LNCH_A/playerstats2/statistics?populations={ids}&statistics=operatorpvp_timeplayed,operatorpvp_roundwon,operatorpvp_roundlost,operatorpvp_kills,operatorpvp_death'
 GUN_URL = 'https://public-ubiservices.ubi.com/v1/spaces/5172a557-50b5-4665-b7db-e3f2e8c5041d/sandboxes/OSBOR_PC_LNCH_A/playerstats2/statistics?populations={ids}&' +\
           'statistics='+','.join(set(s[3] for s in GUN_COLUMN_LIST))
 PROFILE_URL = 'https://public-ubiservices.ubi.com/v2/users/{}/profiles'
+ALL_STATS_URL = 'https://public-ubiservices.ubi.com/v1/spaces/5172a557-50b5-4665-b7db-e3f2e8c5041d/sandboxes/OSBOR_PC_LNCH_A/playerstats2/statistics?populations={ids}&' +\
+                'statistics='+','.join(sorted(set([s[3] for s in STAT_LIST] + ['operatorpvp_' + s[0] for s in OPERATOR_STAT_LIST] + [s[3] for s in GUN_COLUMN_LIST])))
+
+# Endpoint families: [0] family name, [1] URL prefix
+ENDPOINT_FAMILIES = [
+    ('login', LOGIN_URL),
+    ('profiles', PLAYER_URL.split('{')[0]),
+    ('profiles', PROFILE_URL.split('{')[0]),
+    ('ranks', PROGRESS_URL.split('{')[0]),
+    ('stats', STATS_URL.split('{')[0])
+    ]
+# Seconds a cached response stays valid for each endpoint family
+CACHE_TTL = {
+    'profiles': 6 * 3600,
+    'ranks': 60,
+    'stats': 60
+    }
+# Request budget for each endpoint family: (requests per second, burst size)
+RATE_LIMITS = {
+    'login': (0.1, 1),
+    'profiles': (5, 10),
+    'ranks': (5, 10),
+    'stats': (5, 10)
+    }
+# Retries of throttled (429) and failed (5xx) requests, delays are in seconds
+MAX_RETRIES = 5
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+# Tickets are renewed this many seconds before they expire
+TICKET_REFRESH_MARGIN = 300
 
 RANKS = [
     'Unranked',
@@ -0,0 +1,67 @@
+import contextlib
+import queue
+import sqlite3
+import threading
+from r6siegetracker.constants import SQLITE_PRAGMAS
+
+
+'''
+Opens rainbow.db (or another tracker database) with the tracker pragmas applied
+Read-only connections cannot change the journal mode, they use the mode set by the writer
+'''
+def connect(filename='rainbow.db', readonly=False):
+    if readonly:
+        db = sqlite3.connect('file:{}?mode=ro'.format(filename), uri=True, check_same_thread=False)
+    else:
+        db = sqlite3.connect(filename, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    for pragma, value in SQLITE_PRAGMAS:
+        if readonly and pragma == 'journal_mode':
+            continue
+        db.execute('PRAGMA {} = {};'.format(pragma, value))
+    return db
+
+
+class ReaderPool:
+    '''
+    ReaderPool hands out read-only connections to the database, up to `size` of them are opened
+    In WAL mode readers see the last committed state and are not blocked by a running write
+    '''
+
+    def __init__(self, filename='rainbow.db', size=4):
+        self.filename = filename
+        self.size = size
+        self.pool = queue.LifoQueue()
+        self.opened = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        db = None
+        try:
+            db = self.pool.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                if len(self.opened) < self.size:
+                    db = connect(self.filename, readonly=True)
+                    self.opened.append(db)
+            if db is None:
+                db = self.pool.get()
+        try:
+            yield db
+        finally:
+            self.pool.put(db)
+
+    '''
+    Runs a query on a pooled connection and returns all rows
+    '''
+    def query(self, sqcmd, params=()):
+        with self.connection() as db:
+            return db.execute(sqcmd, params).fetchall()
+
+    def close(self):
+        with self.lock:
+            for db in self.opened:
+                db.close()
+            self.opened = []
+            self.pool = queue.LifoQueue()
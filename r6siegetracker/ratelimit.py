@@ -0,0 +1,103 @@
+import random
+import threading
+import time
+import datetime
+import email.utils
+from r6siegetracker.constants import RATE_LIMITS, BACKOFF_BASE, BACKOFF_MAX
+
+
+class TokenBucket:
+    '''
+    TokenBucket allows `rate` requests per second on average with bursts up to `capacity` requests
+    acquire blocks the calling thread until a token is available
+    '''
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    '''
+    Takes `tokens` tokens without waiting, returns False if they are not available
+    '''
+    def try_acquire(self, tokens=1):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if now >= self.paused_until and self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    '''
+    Holds back all requests of the bucket for the given number of seconds (e.g. after a 429 response)
+    '''
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class RateLimiter:
+    '''
+    RateLimiter keeps a token bucket per endpoint family, limits are given as family -> (rate, capacity)
+    Given limits replace RATE_LIMITS as a whole, families without a limit are not throttled (e.g. {} for no limits)
+    '''
+
+    def __init__(self, limits=None):
+        if limits is None:
+            limits = RATE_LIMITS
+        self.buckets = {family: TokenBucket(rate, capacity) for family, (rate, capacity) in limits.items()}
+
+    def acquire(self, family):
+        if family in self.buckets:
+            self.buckets[family].acquire()
+
+    '''
+    Holds back the requests of the family, returns False if the family has no bucket and the caller has to wait itself
+    '''
+    def pause(self, family, seconds):
+        if family in self.buckets:
+            self.buckets[family].pause(seconds)
+            return True
+        return False
+
+
+'''
+Returns the number of seconds to wait before retrying, Retry-After is honored when given
+Otherwise the delay grows exponentially with the attempt number and is randomized to spread the retries
+'''
+def backoff_delay(attempt, retry_after=None):
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            date = email.utils.parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            # Malformed header, use the exponential delay
+            date = None
+        if date is not None:
+            # HTTP dates are in GMT, a date without a timezone is not local time
+            if date.tzinfo is None:
+                date = date.replace(tzinfo=datetime.timezone.utc)
+            return max(0.0, date.timestamp() - time.time())
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
@@ -0,0 +1,146 @@
+import datetime
+import math
+from r6siegetracker.ratelimit import TokenBucket
+from r6siegetracker.constants import MAX_IDS_PER_REQUEST, SCHEDULER_BUDGET, SCHEDULER_HISTORY, SCHEDULER_MIN_PROBABILITY, SCHEDULER_MAX_AGE
+
+
+class PollScheduler:
+    '''
+    PollScheduler decides which players are checked for new games, instead of all players in every save_state
+    The games per hour of day of every player are learned from the stats of the last `history` days
+    A player is due once a new game since their last poll has at least `min_probability`, or after `max_age` hours
+    All requests of the polls stay within `budget` requests per hour, the most likely players go first
+    A poll is charged as if all its players had new games: a match count and a stats request for every
+    ids_per_request players and a rank request for every ids_per_request players of a region
+
+    Usage: scheduler = PollScheduler(tracker); scheduler.save_state()
+       or: tracker.save_state(players=scheduler.due()) followed by scheduler.polled(players)
+    '''
+
+    def __init__(self, tracker, budget=SCHEDULER_BUDGET, history=SCHEDULER_HISTORY,
+                 min_probability=SCHEDULER_MIN_PROBABILITY, max_age=SCHEDULER_MAX_AGE):
+        self.tracker = tracker
+        self.history = history
+        self.min_probability = min_probability
+        self.max_age = datetime.timedelta(hours=max_age)
+        # A single request covers up to max_ids_per_request players, an hour of budget can be spent at once
+        self.bucket = TokenBucket(budget / 3600, max(1, budget))
+        self.ids_per_request = getattr(tracker.u, 'max_ids_per_request', MAX_IDS_PER_REQUEST)
+        # Expected games in each hour of day by player id, and the last poll of each player
+        self.rates = {}
+        self.learned = None
+        self.last_poll = {}
+
+    '''
+    Learns the games per hour of day of every player from the match counts of their records
+    Every player with stats gets rates, zero if they have not played in the last `history` days
+    The hourly profile is blended with the daily average, so a game at a new hour does not go unnoticed for a day
+    '''
+    def learn(self, now=None):
+        now = now or datetime.datetime.now()
+        since = str(now - datetime.timedelta(days=self.history))
+        rows = self.tracker.read('''SELECT player_id, CAST(strftime('%H', dt) AS INTEGER) AS hour, SUM(games) AS games, MIN(first) AS first FROM (
+                                        SELECT s.player_id, r.dt, MIN(r.dt) OVER (PARTITION BY s.player_id) AS first,
+                                               s.match_played - LAG(s.match_played) OVER (PARTITION BY s.player_id ORDER BY s.record_id) AS games
+                                        FROM stats s, records r WHERE r.id = s.record_id AND r.dt >= ?)
+                                    GROUP BY player_id, hour;''', (since,))
+        games = {}
+        first = {}
+        for row in rows:
+            games.setdefault(row['player_id'], [0]*24)[row['hour']] += max(row['games'] or 0, 0)
+            first[row['player_id']] = min(first.get(row['player_id'], row['first']), row['first'])
+        self.rates = {}
+        for player_id, hours in games.items():
+            # Days the player has been tracked in the window, at least one
+            days = max(1, (now - datetime.datetime.fromisoformat(first[player_id])).total_seconds() / 86400)
+            average = sum(hours) / 24
+            self.rates[player_id] = [(hours[h] + average) / 2 / days for h in range(24)]
+        # Players with older records but no games in the window are idle, they are only polled after max_age
+        for row in self.tracker.read('SELECT player_id FROM latest_stats;'):
+            self.rates.setdefault(row['player_id'], [0]*24)
+        self.learned = now
+        return self.rates
+
+    '''
+    Returns the probability that a player has played a game since their last poll
+    Players who were never polled or have no stats yet are certainly due
+    '''
+    def probability(self, player_id, now):
+        last = self.last_poll.get(player_id)
+        if last is None or player_id not in self.rates:
+            return 1.0
+        if now - last >= self.max_age:
+            return 1.0
+        return 1 - math.exp(-expected_games(self.rates[player_id], last, now))
+
+    '''
+    Returns the rows of the players to poll now, they are ordered by the probability of a new game
+    '''
+    def due(self, now=None):
+        now = now or datetime.datetime.now()
+        if self.learned is None or now - self.learned >= datetime.timedelta(hours=1):
+            self.learn(now)
+        candidates = []
+        for player in self.tracker.get_all_players():
+            p = self.probability(player['id'], now)
+            if p >= self.min_probability:
+                candidates.append((p, player))
+        candidates.sort(key=lambda c: -c[0])
+        # A player who starts a new chunk costs the requests of that chunk
+        due = []
+        regions = {}
+        for p, player in candidates:
+            requests = 0
+            if len(due) % self.ids_per_request == 0:
+                # Match count and stats requests
+                requests += 2
+            if regions.get(player['region'], 0) % self.ids_per_request == 0:
+                # Rank request of the region
+                requests += 1
+            if not self.bucket.try_acquire(requests):
+                break
+            due.append(player)
+            regions[player['region']] = regions.get(player['region'], 0) + 1
+        if len(due) < len(candidates):
+            print('WARNING: Request budget allows polling {}/{} due players.'.format(len(due), len(candidates)))
+        return due
+
+    '''
+    Marks the players as polled
+    '''
+    def polled(self, players, now=None):
+        now = now or datetime.datetime.now()
+        for player in players:
+            self.last_poll[player['id']] = now
+
+    '''
+    Runs save_state for the players who are due, returns the record id or None
+    '''
+    def save_state(self, verbose=False):
+        players = self.due()
+        if not players:
+            print('INFO: No players are due.')
+            return None
+        print('INFO: Polling {} player(s).'.format(len(players)))
+        record_id = self.tracker.save_state(verbose, players=players)
+        self.polled(players)
+        return record_id
+
+
+'''
+Returns the expected number of games between start and end from the games per hour of day
+'''
+def expected_games(rates, start, end):
+    seconds = (end - start).total_seconds()
+    if seconds <= 0:
+        return 0
+    days, seconds = divmod(seconds, 86400)
+    total = days * sum(rates)
+    t = start + datetime.timedelta(days=days)
+    end = t + datetime.timedelta(seconds=seconds)
+    while t < end:
+        # Up to the start of the next hour
+        step = min(end, t.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1))
+        total += rates[t.hour] * (step - t).total_seconds() / 3600
+        t = step
+    return total
@@ -0,0 +1,211 @@
+import datetime
+import json
+import random
+import threading
+import time
+import uuid
+import zlib
+from urllib.parse import urlparse, parse_qs
+from r6siegetracker.constants import *
+from r6siegetracker.ratelimit import TokenBucket
+from r6siegetracker.connect import UbiConnection, endpoint_family
+
+
+class SimulatedResponse:
+    '''
+    Minimal stand-in for requests.Response
+    '''
+
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.text = json.dumps(data if data is not None else {})
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.text)
+
+    def __repr__(self):
+        return '<SimulatedResponse [{}]>'.format(self.status_code)
+
+
+class UbiSimulator:
+    '''
+    UbiSimulator is an offline transport for UbiConnection(transport=...)
+    It serves the login, profile, stats and rank endpoints from synthetic players or recorded fixtures
+
+    players: number of synthetic profiles, named Player0, Player1, ...
+    latency: seconds added to every request
+    error_rate: ratio of requests answered with 503
+    rate_limit: (requests per second, burst size), requests over the limit are answered with 429
+    fixtures: dictionary or JSON file of url -> [status code, response] recorded by RecordingTransport
+    '''
+
+    def __init__(self, players=1000, latency=0.0, error_rate=0.0, rate_limit=None, fixtures=None,
+                 season=17, ticket_lifetime=3*3600, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.bucket = TokenBucket(*rate_limit) if rate_limit else None
+        if isinstance(fixtures, str):
+            f = open(fixtures, 'r')
+            fixtures = json.load(f)
+            f.close()
+        self.fixtures = fixtures or {}
+        self.season = season
+        self.ticket_lifetime = ticket_lifetime
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.ids = [str(uuid.UUID(int=(seed << 64) + i + 1)) for i in range(players)]
+        self.index = {id: i for i, id in enumerate(self.ids)}
+        self.names = {'player{}'.format(i): id for i, id in enumerate(self.ids)}
+        self.games = [20 + (i * 7919) % 500 for i in range(players)]
+        self.ticket = None
+        self.requests = {}
+        self.headers = dict(UBI_HEADERS)
+
+    '''
+    Lets a random `fraction` of the players play between 1 and `games` matches
+    Returns the IDs of the players who have played
+    '''
+    def play(self, fraction=0.05, games=3):
+        with self.lock:
+            played = self.random.sample(range(len(self.ids)), int(len(self.ids) * fraction))
+            for i in played:
+                self.games[i] += self.random.randint(1, games)
+        return [self.ids[i] for i in played]
+
+    def post(self, url, auth=None, json=None, headers=None, **kwargs):
+        return self.request('POST', url, headers)
+
+    def get(self, url, headers=None, **kwargs):
+        return self.request('GET', url, headers)
+
+    def close(self):
+        pass
+
+    def request(self, method, url, headers):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            family = endpoint_family(url)
+            self.requests[family] = self.requests.get(family, 0) + 1
+            if self.bucket is not None and not self.bucket.try_acquire():
+                return SimulatedResponse(429, headers={'Retry-After': '1'})
+            if self.error_rate and self.random.random() < self.error_rate:
+                return SimulatedResponse(503)
+            if url in self.fixtures:
+                status, data = self.fixtures[url]
+                return SimulatedResponse(status, data)
+            if method == 'POST' and url == LOGIN_URL:
+                return self.login()
+            if headers is None or headers.get('Authorization') != 'Ubi_v1 t={}'.format(self.ticket):
+                return SimulatedResponse(401)
+            query = {k: v[0] for k, v in parse_qs(urlparse(url).query).items()}
+            if family == 'profiles' and url.startswith(PLAYER_URL.split('{')[0]):
+                return self.profiles([self.names.get(n.lower()) for n in query['nameOnPlatform'].split(',')])
+            elif family == 'profiles':
+                return self.profiles([urlparse(url).path.split('/')[-2]])
+            elif family == 'stats':
+                return self.stats(query['populations'].split(','), query['statistics'].split(','))
+            elif family == 'ranks':
+                return self.ranks(query['profile_ids'].split(','), query['region_id'], int(query['season_id']))
+            return SimulatedResponse(404)
+
+    def login(self):
+        self.ticket = uuid.UUID(int=self.random.getrandbits(128)).hex
+        expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.ticket_lifetime)
+        return SimulatedResponse(200, {
+            'ticket': self.ticket,
+            'sessionId': str(uuid.UUID(int=self.random.getrandbits(128))),
+            'userId': self.ids[0],
+            'profileId': self.ids[0],
+            'expiration': expiration.strftime('%Y-%m-%dT%H:%M:%S.0000000Z')
+            })
+
+    def profiles(self, ids):
+        profiles = []
+        for id in ids:
+            if id in self.index:
+                profiles.append({'profileId': id, 'userId': id, 'platformType': 'uplay',
+                                 'nameOnPlatform': 'Player{}'.format(self.index[id])})
+        return SimulatedResponse(200, {'profiles': profiles})
+
+    '''
+    Stats grow linearly with the games played, every player has their own rates
+    '''
+    def value(self, i, key):
+        rate = zlib.crc32('{}:{}:{}'.format(self.seed, i, key).encode()) % 1000
+        return self.games[i] * rate // 100
+
+    def stats(self, ids, statistics):
+        results = {}
+        for id in ids:
+            if id not in self.index:
+                continue
+            i = self.index[id]
+            p_stats = {}
+            for stat in statistics:
+                if stat.startswith('operatorpvp_'):
+                    keys = ['{}:{}:infinite'.format(stat, o[0]) for o in OPERATOR_LIST]
+                elif stat.startswith('weapontypepvp_'):
+                    keys = ['{}:{}:infinite'.format(stat, g[0]) for g in GUN_LIST]
+                else:
+                    keys = [stat + ':infinite']
+                for key in keys:
+                    p_stats[key] = self.games[i] if stat == 'generalpvp_matchplayed' else self.value(i, key)
+            results[id] = p_stats
+        return SimulatedResponse(200, {'results': results})
+
+    def ranks(self, ids, region, season):
+        players = {}
+        for id in ids:
+            i = self.index.get(id, 0)
+            wins = self.value(i, '{}:{}:wins'.format(region, season)) // 10
+            losses = self.value(i, '{}:{}:losses'.format(region, season)) // 10
+            mmr = 1500 + self.value(i, '{}:{}:mmr'.format(region, season)) % 3000
+            players[id] = {'board_id': 'pvp_ranked', 'region': region, 'profile_id': id,
+                           'season': self.season if season == -1 else season,
+                           'mmr': mmr, 'max_mmr': mmr + 100, 'skill_mean': mmr / 100, 'skill_stdev': 5.0,
+                           'rank': min(23, mmr // 200), 'max_rank': min(23, mmr // 200 + 1),
+                           'wins': wins, 'losses': losses, 'abandons': 0}
+        return SimulatedResponse(200, {'players': players})
+
+
+class RecordingTransport:
+    '''
+    RecordingTransport wraps a transport (by default a pooled requests session) and records every response
+    save writes the recordings as fixtures for UbiSimulator
+    '''
+
+    def __init__(self, transport=None):
+        if transport is None:
+            transport = UbiConnection.create_http_session()
+        self.transport = transport
+        self.fixtures = {}
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        r = self.transport.get(url, **kwargs)
+        self.record(url, r)
+        return r
+
+    def post(self, url, **kwargs):
+        # Login responses hold session secrets, they are not recorded
+        return self.transport.post(url, **kwargs)
+
+    def record(self, url, r):
+        try:
+            data = r.json()
+        except ValueError:
+            return
+        with self.lock:
+            self.fixtures[url] = [r.status_code, data]
+
+    def save(self, filename='fixtures.json'):
+        f = open(filename, 'w')
+        with self.lock:
+            json.dump(self.fixtures, f)
+        f.close()
+
+    def close(self):
+        self.transport.close()
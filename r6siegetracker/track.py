@@ -1,33 +1,59 @@
 import os
+import csv
+import gzip
 import sqlite3
-from r6siegetracker.connect import UbiConnection
-from r6siegetracker.constants import STAT_LIST, PROGRESS_LIST, RANKS, REGIONS, SEASONS, DB_VERSION, EMBER_RISE_NEW_RANKS
-from r6siegetracker.constants import SORTED_OPERATOR_LIST, OPERATOR_COLUMN_LIST,  GUN_LIST, GUN_COLUMN_LIST
+import asyncio
+import itertools
+from r6siegetracker.connect import UbiConnection, AsyncUbiConnection
+from r6siegetracker.database import connect, ReaderPool
+from r6siegetracker.constants import STAT_LIST, PROGRESS_LIST, RANKS, REGIONS, SEASONS, DB_VERSION, EMBER_RISE_NEW_RANKS, ALIAS_MAX_AGE, ROLLUP_PERIODS, EXPORT_BATCH_SIZE, BACKUP_PAGES
+from r6siegetracker.constants import SORTED_OPERATOR_LIST, OPERATOR_LIST, OPERATOR_STAT_LIST, OPERATOR_COLUMN_LIST,  GUN_LIST, GUN_COLUMN_LIST
 import datetime
-from shutil import copyfile
+
+# Insert statements of the snapshot tables, built once from the column lists
+STATS_COLUMNS = ['player_id', 'record_id'] + [s[1] for s in STAT_LIST] + [p[1] for p in PROGRESS_LIST]
+OPERATOR_STATS_COLUMNS = ['player_id', 'record_id', 'operator'] + [s[2] for s in OPERATOR_STAT_LIST]
+GUN_STATS_COLUMNS = ['player_id', 'record_id'] + [g[1] for g in GUN_COLUMN_LIST]
+STATS_INSERT = 'INSERT INTO stats ({}) VALUES ({});'.format(', '.join(STATS_COLUMNS), ', '.join('?'*len(STATS_COLUMNS)))
+OPERATOR_STATS_INSERT = 'INSERT INTO operator_stats ({}) VALUES ({});'.format(', '.join(OPERATOR_STATS_COLUMNS), ', '.join('?'*len(OPERATOR_STATS_COLUMNS)))
+GUN_STATS_INSERT = 'INSERT INTO gun_stats ({}) VALUES ({});'.format(', '.join(GUN_STATS_COLUMNS), ', '.join('?'*len(GUN_STATS_COLUMNS)))
 
 class R6Tracker():
 
     '''
     R6Tracker objects is used to record stats into local database
     '''
-    def __init__(self, ubiconnect):
-        # Database information
+    def __init__(self, ubiconnect, readers=4):
+        # Database information, writes go through self.db and reports use the read-only connections
         if not os.path.isfile('rainbow.db'):
             self.install()
         else:
-            self.db = sqlite3.connect('rainbow.db', check_same_thread=False)
-        self.db.row_factory = sqlite3.Row
+            self.db = connect('rainbow.db')
         self.cursor = self.db.cursor()
+        self.readers = ReaderPool('rainbow.db', readers)
         self.u = ubiconnect
+        self.au = None
         print('INFO: Initialized the tracker.')
 
+    '''
+    Runs a read-only query on a pooled reader connection and returns all rows
+    '''
+    def read(self, sqcmd, params=()):
+        return self.readers.query(sqcmd, params)
+
+    '''
+    Returns the asyncio connection wrapping the tracker's UbiConnection
+    '''
+    def get_async_connection(self):
+        if self.au is None:
+            self.au = AsyncUbiConnection(self.u)
+        return self.au
+
     '''
     Creates database files for the first use
     '''
-    def install(self, check=True):
-        self.db = sqlite3.connect('rainbow.db', check_same_thread=False)
-        self.db.row_factory = sqlite3.Row
+    def install(self, check=True, legacy=False):
+        self.db = connect('rainbow.db')
         self.cursor = self.db.cursor()
         # Table 1 DBINFO
         self.cursor.execute('''CREATE TABLE IF NOT EXISTS
@@ -70,11 +96,19 @@ class R6Tracker():
                                      {} FLOAT,
                                      PRIMARY KEY (player_id, season));
                             '''.format(' FLOAT, '.join(p[1] for p in PROGRESS_LIST)))
+        if legacy:
+            # Wide operator table of versions before 17, only created by the updates which rebuild it
+            self.cursor.execute('''CREATE TABLE IF NOT EXISTS
+                                   op_stats(player_id INTEGER, record_id INTEGER,
+                                             {} ,
+                                             PRIMARY KEY (player_id, record_id))
+                                '''.format(', '.join(o[2] + ' INTEGER DEFAULT 0' for o in OPERATOR_COLUMN_LIST)))
+        # Operator stats of a record, only the operators whose stats changed since the previous row are stored
         self.cursor.execute('''CREATE TABLE IF NOT EXISTS
-                               op_stats(player_id INTEGER, record_id INTEGER,
-                                         {} ,
-                                         PRIMARY KEY (player_id, record_id))
-                            '''.format(', '.join(o[2] + ' INTEGER DEFAULT 0' for o in OPERATOR_COLUMN_LIST)))
+                               operator_stats(player_id INTEGER, record_id INTEGER, operator VARCHAR(20),
+                                              {} INTEGER,
+                                              PRIMARY KEY (player_id, operator, record_id)) WITHOUT ROWID
+                            '''.format(' INTEGER, '.join(s[2] for s in OPERATOR_STAT_LIST)))
         self.cursor.execute('''CREATE TABLE IF NOT EXISTS
                                gun_stats(player_id INTEGER, record_id INTEGER,
                                          {},
@@ -96,9 +130,54 @@ class R6Tracker():
                                assists INTEGER,
                                deaths INTEGER,
                                mmr FLOAT, PRIMARY KEY(game_id, player_id))''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS
+                               aliases(name VARCHAR(100) PRIMARY KEY COLLATE NOCASE,
+                               uplay_id VARCHAR(1000),
+                               last_seen DATETIME)''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS
+                               rollups(player_id INTEGER, period VARCHAR(10), bucket VARCHAR(10),
+                               record_id INTEGER, dt DATETIME,
+                               PRIMARY KEY(player_id, period, bucket))''')
+        # Last stats record of every player, written with the stats
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS
+                               latest_stats(player_id INTEGER PRIMARY KEY, record_id INTEGER)''')
+        self.create_indexes()
         self.db.commit()
         print('INFO: Installed or updated database rainbow.db.')
 
+    '''
+    Creates indexes for name lookups and time-range joins, the primary keys cover lookups by player
+    '''
+    def create_indexes(self):
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS records_dt ON records(dt);')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS players_name ON players(name);')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS stats_record ON stats(record_id, player_id);')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS gun_stats_record ON gun_stats(record_id, player_id);')
+
+    '''
+    Fills the day and week rollups from the stats table, the season of old records is not known
+    '''
+    def backfill_rollups(self):
+        buckets = {'day': "date(records.dt)",
+                   'week': "date(records.dt, '-' || ((strftime('%w', records.dt) + 6) % 7) || ' days')"}
+        for period in ROLLUP_PERIODS:
+            if period not in buckets:
+                continue
+            self.cursor.execute('''INSERT OR REPLACE INTO rollups (player_id, period, bucket, record_id, dt)
+                                   SELECT player_id, ?, bucket, record_id, dt FROM (
+                                       SELECT stats.player_id, {bucket} as bucket, records.id as record_id, records.dt,
+                                              ROW_NUMBER() OVER (PARTITION BY stats.player_id, {bucket} ORDER BY records.dt DESC) as rn
+                                       FROM stats, records WHERE records.id = stats.record_id)
+                                   WHERE rn = 1;'''.format(bucket=buckets[period]), (period,))
+        self.db.commit()
+
+    '''
+    Fills latest_stats from the stats table, the caller commits
+    '''
+    def backfill_latest_stats(self):
+        self.cursor.execute('DELETE FROM latest_stats;')
+        self.cursor.execute('INSERT INTO latest_stats (player_id, record_id) SELECT player_id, MAX(record_id) FROM stats GROUP BY player_id;')
+
     '''
     Updates the database (new operators, etc..)
     '''
@@ -108,7 +187,7 @@ class R6Tracker():
         if version == 2: # 2 to 3 upgrade
             self.cursor.execute('ALTER TABLE operators RENAME TO _operators')
             self.cursor.execute('ALTER TABLE stats RENAME TO _stats')
-            self.install(False)
+            self.install(False, legacy=True)
             # op_stats
             self.cursor.execute('INSERT INTO op_stats SELECT * FROM _operators;')
             self.cursor.execute('DROP TABLE _operators;')
@@ -129,7 +208,7 @@ class R6Tracker():
         if version == 3: # 3 to 4 upgrade
             # No changes from 3 to 4, except new tables
             # dbinfo
-            self.install(False)
+            self.install(False, legacy=True)
             self.cursor.execute('INSERT OR REPLACE INTO dbinfo (tag, value) VALUES ("version", {});'.format(4))
             self.cursor.execute('INSERT OR REPLACE INTO dbinfo (tag, value) VALUES ("update_date", "{}");'.format(datetime.datetime.now()))
             self.db.commit()
@@ -138,7 +217,7 @@ class R6Tracker():
         if version == 4: # 4 to 5 upgrade
             # New operators: Alibi and Maestro
             self.cursor.execute('ALTER TABLE op_stats RENAME TO _old_op_stats')
-            self.install(False)
+            self.install(False, legacy=True)
             self.cursor.execute('PRAGMA TABLE_INFO(_old_op_stats);')
             self.cursor.execute('INSERT INTO op_stats ({cols}) SELECT {cols} FROM _old_op_stats;'.format(cols=', '.join([i[1] for i in self.cursor.fetchall()])))
             self.cursor.execute('DROP TABLE _old_op_stats;')
@@ -156,7 +235,7 @@ class R6Tracker():
             self.db.commit()
             self.cursor.execute('ALTER TABLE op_stats RENAME TO _copy;')
             self.db.commit()
-            self.install(False)
+            self.install(False, legacy=True)
             self.cursor.execute('INSERT INTO op_stats SELECT * FROM _copy;')
             self.cursor.execute('DROP TABLE _copy;')
             self.db.commit()
@@ -169,7 +248,7 @@ class R6Tracker():
         if version == 6: # 6 to 7 update
             # New operators clash and maverick
             self.cursor.execute('ALTER TABLE op_stats RENAME TO _old_op_stats')
-            self.install(False)
+            self.install(False, legacy=True)
             self.cursor.execute('PRAGMA TABLE_INFO(_old_op_stats);')
             self.cursor.execute('INSERT INTO op_stats ({cols}) SELECT {cols} FROM _old_op_stats;'.format(cols=', '.join([i[1] for i in self.cursor.fetchall()])))
             self.cursor.execute('DROP TABLE _old_op_stats;')
@@ -183,7 +262,7 @@ class R6Tracker():
         if version == 7: # 7 to 8 update
             # Fix for Capitao typo
             self.cursor.execute('ALTER TABLE op_stats RENAME TO _old_op_stats')
-            self.install(False)
+            self.install(False, legacy=True)
             self.cursor.execute('PRAGMA TABLE_INFO(_old_op_stats);')
             old_cols = []
             new_cols = []
@@ -210,7 +289,7 @@ class R6Tracker():
             self.cursor.execute('DROP TABLE IF EXISTS _op_stats;')
             self.db.commit()
             self.cursor.execute('ALTER TABLE op_stats RENAME TO _old_op_stats')
-            self.install(False)
+            self.install(False, legacy=True)
             self.cursor.execute('PRAGMA TABLE_INFO(_old_op_stats);')
             self.cursor.execute('INSERT INTO op_stats ({cols}) SELECT {cols} FROM _old_op_stats;'.format(cols=', '.join([i[1] for i in self.cursor.fetchall()])))
             self.cursor.execute('DROP TABLE _old_op_stats;')
@@ -226,7 +305,7 @@ class R6Tracker():
             self.cursor.execute('DROP TABLE IF EXISTS _op_stats;')
             self.db.commit()
             self.cursor.execute('ALTER TABLE op_stats RENAME TO _old_op_stats')
-            self.install(False)
+            self.install(False, legacy=True)
             self.cursor.execute('PRAGMA TABLE_INFO(_old_op_stats);')
             self.cursor.execute('INSERT INTO op_stats ({cols}) SELECT {cols} FROM _old_op_stats;'.format(cols=', '.join([i[1] for i in self.cursor.fetchall()])))
             self.cursor.execute('DROP TABLE _old_op_stats;')
@@ -242,7 +321,7 @@ class R6Tracker():
             self.cursor.execute('DROP TABLE IF EXISTS _op_stats;')
             self.db.commit()
             self.cursor.execute('ALTER TABLE op_stats RENAME TO _old_op_stats')
-            self.install(False)
+            self.install(False, legacy=True)
             self.cursor.execute('PRAGMA TABLE_INFO(_old_op_stats);')
             self.cursor.execute('INSERT INTO op_stats ({cols}) SELECT {cols} FROM _old_op_stats;'.format(cols=', '.join([i[1] for i in self.cursor.fetchall()])))
             self.cursor.execute('DROP TABLE _old_op_stats;')
@@ -258,7 +337,7 @@ class R6Tracker():
             self.cursor.execute('DROP TABLE IF EXISTS _op_stats;')
             self.db.commit()
             self.cursor.execute('ALTER TABLE op_stats RENAME TO _old_op_stats')
-            self.install(False)
+            self.install(False, legacy=True)
             self.cursor.execute('PRAGMA TABLE_INFO(_old_op_stats);')
             self.cursor.execute('INSERT INTO op_stats ({cols}) SELECT {cols} FROM _old_op_stats;'.format(cols=', '.join([i[1] for i in self.cursor.fetchall()])))
             self.cursor.execute('DROP TABLE _old_op_stats;')
@@ -274,7 +353,7 @@ class R6Tracker():
             self.cursor.execute('DROP TABLE IF EXISTS _op_stats;')
             self.db.commit()
             self.cursor.execute('ALTER TABLE op_stats RENAME TO _old_op_stats')
-            self.install(False)
+            self.install(False, legacy=True)
             self.cursor.execute('PRAGMA TABLE_INFO(_old_op_stats);')
             self.cursor.execute('INSERT INTO op_stats ({cols}) SELECT {cols} FROM _old_op_stats;'.format(cols=', '.join([i[1] for i in self.cursor.fetchall()])))
             self.cursor.execute('DROP TABLE _old_op_stats;')
@@ -285,13 +364,90 @@ class R6Tracker():
             self.db.commit()
             print('Updated DB to version {}'.format(version+1))
             version += 1
+        if version == 13:
+            # New table: aliases
+            self.install(False, legacy=True)
+            self.cursor.execute('INSERT OR REPLACE INTO dbinfo (tag, value) VALUES ("version", {});'.format(version+1))
+            self.cursor.execute('INSERT OR REPLACE INTO dbinfo (tag, value) VALUES ("update_date", "{}");'.format(datetime.datetime.now()))
+            self.db.commit()
+            print('Updated DB to version {}'.format(version+1))
+            version += 1
+        if version == 14:
+            # Indexes on records, players and record_id of stat tables
+            self.create_indexes()
+            self.cursor.execute('ANALYZE;')
+            self.cursor.execute('INSERT OR REPLACE INTO dbinfo (tag, value) VALUES ("version", {});'.format(version+1))
+            self.cursor.execute('INSERT OR REPLACE INTO dbinfo (tag, value) VALUES ("update_date", "{}");'.format(datetime.datetime.now()))
+            self.db.commit()
+            print('Updated DB to version {}'.format(version+1))
+            version += 1
+        if version == 15:
+            # New table: rollups, filled from the existing records
+            self.install(False, legacy=True)
+            self.backfill_rollups()
+            self.cursor.execute('INSERT OR REPLACE INTO dbinfo (tag, value) VALUES ("version", {});'.format(version+1))
+            self.cursor.execute('INSERT OR REPLACE INTO dbinfo (tag, value) VALUES ("update_date", "{}");'.format(datetime.datetime.now()))
+            self.db.commit()
+            print('Updated DB to version {}'.format(version+1))
+            version += 1
+        if version == 16:
+            # op_stats -> operator_stats, a row is kept when the stats of an operator differ from the previous record
+            self.install(False)
+            self.cursor.execute('PRAGMA TABLE_INFO(op_stats);')
+            existing = [i[1] for i in self.cursor.fetchall()]
+            stats = [s[2] for s in OPERATOR_STAT_LIST]
+            for op in OPERATOR_LIST:
+                cols = [op[2] + '_' + s for s in stats]
+                if any(c not in existing for c in cols):
+                    continue
+                self.cursor.execute('''INSERT INTO operator_stats (player_id, record_id, operator, {stats})
+                                       SELECT player_id, record_id, ?, {cols} FROM (
+                                           SELECT player_id, record_id, {cols}, {previous}
+                                           FROM op_stats WINDOW w AS (PARTITION BY player_id ORDER BY record_id))
+                                       WHERE NOT ({same});'''.format(
+                                        stats=', '.join(stats), cols=', '.join(cols),
+                                        previous=', '.join('LAG({c}, 1, 0) OVER w AS _{c}'.format(c=c) for c in cols),
+                                        same=' AND '.join('{c} IS _{c}'.format(c=c) for c in cols)), (op[2],))
+            self.cursor.execute('DROP TABLE op_stats;')
+            self.cursor.execute('INSERT OR REPLACE INTO dbinfo (tag, value) VALUES ("version", {});'.format(version+1))
+            self.cursor.execute('INSERT OR REPLACE INTO dbinfo (tag, value) VALUES ("update_date", "{}");'.format(datetime.datetime.now()))
+            self.db.commit()
+            self.cursor.execute('VACUUM;')
+            print('Updated DB to version {}'.format(version+1))
+            version += 1
+        if version == 17:
+            # gun_stats rows equal to the previous row of the player are removed
+            cols = [g[1] for g in GUN_COLUMN_LIST]
+            self.cursor.execute('''DELETE FROM gun_stats WHERE rowid IN (
+                                       SELECT rowid FROM (
+                                           SELECT rowid, {cols}, {previous}
+                                           FROM gun_stats WINDOW w AS (PARTITION BY player_id ORDER BY record_id))
+                                       WHERE {same});'''.format(
+                                    cols=', '.join(cols),
+                                    previous=', '.join('LAG({c}) OVER w AS _{c}'.format(c=c) for c in cols),
+                                    same=' AND '.join('{c} IS _{c}'.format(c=c) for c in cols)))
+            self.cursor.execute('INSERT OR REPLACE INTO dbinfo (tag, value) VALUES ("version", {});'.format(version+1))
+            self.cursor.execute('INSERT OR REPLACE INTO dbinfo (tag, value) VALUES ("update_date", "{}");'.format(datetime.datetime.now()))
+            self.db.commit()
+            self.cursor.execute('VACUUM;')
+            print('Updated DB to version {}'.format(version+1))
+            version += 1
+        if version == 18:
+            # New table: latest_stats, filled from the existing records
+            self.install(False)
+            self.backfill_latest_stats()
+            self.cursor.execute('INSERT OR REPLACE INTO dbinfo (tag, value) VALUES ("version", {});'.format(version+1))
+            self.cursor.execute('INSERT OR REPLACE INTO dbinfo (tag, value) VALUES ("update_date", "{}");'.format(datetime.datetime.now()))
+            self.db.commit()
+            print('Updated DB to version {}'.format(version+1))
+            version += 1
             
     '''
     Adds a new player to the database
     '''
     def add_player(self, name, region=None):
         u = self.u
-        id = u.get_player_by_name(name)
+        id = self.resolve_name(name)
         if id is None:
             print('ERROR: Failed to add {}, ID is not found'.format(name))
             return None
@@ -304,6 +460,8 @@ class R6Tracker():
                 region = 'ncsa'
                 for r in REGIONS:
                     r_dict = u.get_rank(id, r[1])
+                    if r_dict is None:
+                        continue
                     region_games = r_dict['wins'] + r_dict['losses']
                     if region_games > max_games:
                         region = r[1]
@@ -325,9 +483,8 @@ class R6Tracker():
     Removes a player from the database
     '''
     def remove_player(self, name):
-        u = self.u
-        id = u.get_player_by_name(name)
-        self.cursor.execute('DELETE FROM players WHERE uplay_id = "{}"'.format(id))
+        id = self.resolve_name(name)
+        self.cursor.execute('DELETE FROM players WHERE uplay_id = ?', (id,))
         self.db.commit()
         if self.cursor.rowcount == 1:
             print('INFO: Removed player {} (ID={})'.format(name, id))
@@ -336,78 +493,223 @@ class R6Tracker():
             print('WARNING: Could not remove player {}, does not exist!'.format(name))
             return False
 
+    '''
+    Returns Uplay IDs of the given names as a dictionary, None for names that cannot be found
+    Names are looked up in players table, then in aliases table, the rest is requested in bulk from the API
+    '''
+    def resolve_names(self, names):
+        ids = {}
+        rows = self.read('SELECT name, uplay_id FROM players WHERE name COLLATE NOCASE IN ({});'.format(','.join('?'*len(names))), names)
+        known = {row['name'].lower(): row['uplay_id'] for row in rows}
+        rows = self.read('''SELECT name, uplay_id FROM aliases
+                            WHERE name IN ({}) AND last_seen >= datetime("now", "localtime", "-{} days");'''.format(','.join('?'*len(names)), ALIAS_MAX_AGE), names)
+        for row in rows:
+            known.setdefault(row['name'].lower(), row['uplay_id'])
+        missing = []
+        for name in names:
+            if name.lower() in known:
+                ids[name] = known[name.lower()]
+            elif name not in missing:
+                missing.append(name)
+        if missing:
+            found = self.u.get_players_by_names(missing)
+            now = str(datetime.datetime.now())
+            self.cursor.executemany('INSERT OR REPLACE INTO aliases (name, uplay_id, last_seen) VALUES (?,?,?);',
+                                    [(name, id, now) for name, id in found.items() if id is not None])
+            self.db.commit()
+            ids.update(found)
+        return ids
+
+    '''
+    Returns Uplay ID of the given name, see resolve_names
+    '''
+    def resolve_name(self, name):
+        return self.resolve_names([name])[name]
+
     '''
     Creates an entry in records table, it checks all players record only those who have played games since the last record
+    players limits the check to the given rows of the players table
+    '''
+    def save_state(self, verbose=False, force=False, players=None):
+        entries = self.prepare_state(force=force, players=players)
+        if entries is None:
+            return None
+        # Create a new record point with all stats
+        record_id = self.write_state(entries, verbose)
+        
+        # Update seasons stats
+        # self.save_season_stats()
+        
+        print('Saved the current stats to DB.')
+        return record_id
+
+    '''
+    Fetches the stats of the players who have played games since their last record, nothing is written to DB
+    Returns the entries for write_state, or None if there are no updates
+    pending maps player ids to the match counts of entries which are not written yet, these players are not fetched again
+    players limits the check to some of the players (rows of the players table), e.g. the ones due in PollScheduler
     '''
-    def save_state(self, verbose=False, force=False):
+    def prepare_state(self, force=False, pending=None, players=None):
         # Get a list of all players
         u = self.u
-        players = self.get_all_players()
+        if players is None:
+            players = self.get_all_players()
         # Check if there are any updates
         if not players:
             print('ERROR: No players in DB')
             return None
         if not force:
-            new_save = self.is_save_required(players)
+            new_save = self.is_save_required(players, pending=pending)
             if not any(new_save):
                 print('Checked the stats, no updates have been found.')
                 return None
         else:
             new_save = [True for i in players]
 
-        # Crete a new checkpoint
-        print('Getting new records...')
-        dt = str(datetime.datetime.now())
-        # Create a new record point
-        sqcmd = 'INSERT INTO records(dt) VALUES("{}")'.format(dt)
-        self.cursor.execute(sqcmd)
-        record_id = self.cursor.lastrowid
+        # Only the players with new matches are fetched, the others keep their last record
+        changed = [p for i, p in enumerate(players) if new_save[i]]
+        print('Getting new records of {}/{} players...'.format(len(changed), len(players)))
         # Get all stats
-        stats = u.get_stats([p['uplay_id'] for p in players])
-        ops = u.get_operator_stats([p['uplay_id'] for p in players])
-        guns = u.get_gun_stats([p['uplay_id'] for p in players])
-        for i, player in enumerate(players):
-            p_stat = stats[i]
-            p_op_stat = ops[i]
-            p_gun_stat = guns[i]
-            if not new_save[i]:
+        stats, ops, guns = u.get_all_stats([p['uplay_id'] for p in changed])
+        # Get ranks, one request per region
+        ranks = {}
+        for region, ids in group_by_region(changed).items():
+            ranks.update(u.get_ranks(ids, region=region))
+        entries = []
+        for i, player in enumerate(changed):
+            if player['uplay_id'] not in ranks:
+                print('WARNING: No rank data for {}, skipped.'.format(player['name']))
                 continue
             print('Getting current stats for {}'.format(player['name']))
-            # Get stats
-            rank = u.get_rank(player['uplay_id'], region=player['region'])
-            all_stats = []
-            for s in STAT_LIST:
-                try:
-                    all_stats.append(str(p_stat[s[0]]))
-                except: # When a specific stat is not available (e.g. never played ranked...)
-                    all_stats.append('0')
-                if verbose:
-                    print('{}: {}'.format(s[2], all_stats[-1]))
-            for p in PROGRESS_LIST:
-                all_stats.append(str(rank[p[0]]))
-                if verbose:
-                    print('{}: {}'.format(p[2], all_stats[-1]))
-            merged_stats = ','.join(all_stats)
-            # Insert to DB
-            sqcmd = 'INSERT INTO stats VALUES({},{},{});'.format(player['id'], record_id, merged_stats)
-            self.cursor.execute(sqcmd)
-            op_merged_stats = ', '.join(str(p_op_stat[op[0]]) if op[0] in p_op_stat else '0' for op in OPERATOR_COLUMN_LIST)
-            opsqcmd = 'INSERT INTO op_stats VALUES({}, {}, {});'.format(player['id'], record_id, op_merged_stats)
-            self.cursor.execute(opsqcmd)
-            gun_merge_stats = ', '.join(str(p_gun_stat[gn[0]]) if gn[0] in p_gun_stat else '0' for gn in GUN_COLUMN_LIST)
-            gunsqcmd = 'INSERT INTO gun_stats VALUES({}, {}, {});'.format(player['id'], record_id, gun_merge_stats)
-            self.cursor.execute(gunsqcmd)
-        self.db.commit()
-        
-        # Update seasons stats
-        # self.save_season_stats()
-        
+            entries.append((player, stats[i], ops[i], guns[i], ranks[player['uplay_id']]))
+        if not entries:
+            print('ERROR: No stats could be fetched.')
+            return None
+        return entries
+
+    '''
+    Creates an entry in records table like save_state, all network requests are sent concurrently
+    Usage: asyncio.run(tracker.async_save_state())
+    '''
+    async def async_save_state(self, verbose=False, force=False):
+        au = self.get_async_connection()
+        players = self.get_all_players()
+        if not players:
+            print('ERROR: No players in DB')
+            return None
+        ids = [p['uplay_id'] for p in players]
+        if not force:
+            games = await au.get_total_games(ids)
+            new_save = self.is_save_required(players, games)
+            if not any(new_save):
+                print('Checked the stats, no updates have been found.')
+                return None
+        else:
+            new_save = [True for i in players]
+
+        changed = [p for i, p in enumerate(players) if new_save[i]]
+        print('Getting new records of {}/{} players...'.format(len(changed), len(players)))
+        regions = group_by_region(changed)
+        all_stats, *ranks = await asyncio.gather(
+            au.get_all_stats([p['uplay_id'] for p in changed]),
+            *[au.get_ranks(r_ids, region=region) for region, r_ids in regions.items()])
+        stats, ops, guns = all_stats
+        ranks = {id: rank for r_dict in ranks for id, rank in r_dict.items()}
+
+        entries = []
+        for i, player in enumerate(changed):
+            if player['uplay_id'] not in ranks:
+                print('WARNING: No rank data for {}, skipped.'.format(player['name']))
+                continue
+            entries.append((player, stats[i], ops[i], guns[i], ranks[player['uplay_id']]))
+        if not entries:
+            print('ERROR: No stats could be fetched.')
+            return None
+        record_id = self.write_state(entries, verbose)
         print('Saved the current stats to DB.')
         return record_id
 
+    '''
+    Creates a record and inserts the stats of all players in a single transaction
+    entries is a list of (player, stats, operator stats, gun stats, rank) tuples, returns the record id
+    '''
+    def write_state(self, entries, verbose=False):
+        now = datetime.datetime.now()
+        with self.db:
+            self.cursor.execute('INSERT INTO records(dt) VALUES(?);', (str(now),))
+            record_id = self.cursor.lastrowid
+            last_ops = self.last_operator_stats([player['id'] for player, *entry in entries])
+            last_guns = self.last_gun_stats([player['id'] for player, *entry in entries])
+            rows = [self.player_stat_rows(player, record_id, *entry, last_ops=last_ops.get(player['id'], {}), last_gun=last_guns.get(player['id']), verbose=verbose)
+                    for player, *entry in entries]
+            self.cursor.executemany(STATS_INSERT, [r[0] for r in rows])
+            self.cursor.executemany(OPERATOR_STATS_INSERT, [op_row for r in rows for op_row in r[1]])
+            self.cursor.executemany(GUN_STATS_INSERT, [r[2] for r in rows if r[2] is not None])
+            self.cursor.executemany('INSERT OR REPLACE INTO latest_stats (player_id, record_id) VALUES (?,?);',
+                                    [(player['id'], record_id) for player, *entry in entries])
+            # The new record is the last one of its day, week and season
+            self.cursor.executemany('INSERT OR REPLACE INTO rollups (player_id, period, bucket, record_id, dt) VALUES (?,?,?,?,?);',
+                                    [(player['id'], period, bucket, record_id, str(now))
+                                     for player, *entry in entries for period, bucket in rollup_buckets(now, entry[3].get('season'))])
+        return record_id
+
+    '''
+    Returns the last stored stats of every operator of the given players as {player_id: {operator: (tp, rw, rl, k, d)}}
+    '''
+    def last_operator_stats(self, player_ids):
+        last_ops = {}
+        if not player_ids:
+            return last_ops
+        stats = [s[2] for s in OPERATOR_STAT_LIST]
+        self.cursor.execute('''SELECT o.player_id, o.operator, {stats}
+                               FROM operator_stats o,
+                                    (SELECT player_id, operator, MAX(record_id) as record_id FROM operator_stats
+                                     WHERE player_id IN ({ids}) GROUP BY player_id, operator) m
+                               WHERE o.player_id = m.player_id AND o.operator = m.operator AND o.record_id = m.record_id;
+                            '''.format(stats=', '.join('o.' + s for s in stats), ids=','.join('?'*len(player_ids))), player_ids)
+        for row in self.cursor.fetchall():
+            last_ops.setdefault(row['player_id'], {})[row['operator']] = tuple(row[s] for s in stats)
+        return last_ops
+
+    '''
+    Returns the values of the last gun_stats row of the given players as {player_id: [values]}
+    '''
+    def last_gun_stats(self, player_ids):
+        if not player_ids:
+            return {}
+        self.cursor.execute('''SELECT g.* FROM players p, gun_stats g
+                               WHERE p.id IN ({}) AND g.player_id = p.id AND
+                                     g.record_id = (SELECT MAX(record_id) FROM gun_stats WHERE player_id = p.id);
+                            '''.format(','.join('?'*len(player_ids))), player_ids)
+        return {row['player_id']: [row[g[1]] for g in GUN_COLUMN_LIST] for row in self.cursor.fetchall()}
+
+    '''
+    Returns the stats, operator_stats and gun_stats rows of a player for the given record
+    Only the operators whose stats differ from last_ops have a row, the gun_stats row is None if it equals last_gun
+    '''
+    def player_stat_rows(self, player, record_id, p_stat, p_op_stat, p_gun_stat, rank, last_ops=None, last_gun=None, verbose=False):
+        stat_row = [player['id'], record_id]
+        for s in STAT_LIST:
+            # A specific stat may not be available (e.g. never played ranked...)
+            stat_row.append(p_stat.get(s[0], 0))
+            if verbose:
+                print('{}: {}'.format(s[2], stat_row[-1]))
+        for p in PROGRESS_LIST:
+            stat_row.append(rank[p[0]])
+            if verbose:
+                print('{}: {}'.format(p[2], stat_row[-1]))
+        op_rows = []
+        last_ops = last_ops or {}
+        for op in OPERATOR_LIST:
+            values = tuple(p_op_stat.get('operatorpvp_{}:{}:infinite'.format(s[0], op[0]), 0) for s in OPERATOR_STAT_LIST)
+            if values != last_ops.get(op[2], (0,)*len(OPERATOR_STAT_LIST)):
+                op_rows.append([player['id'], record_id, op[2]] + list(values))
+        gun_values = [p_gun_stat.get(gn[0], 0) for gn in GUN_COLUMN_LIST]
+        gun_row = None if gun_values == last_gun else [player['id'], record_id] + gun_values
+        return stat_row, op_rows, gun_row
+
     def get_last_record_id(self):
-        self.cursor.execute('SELECT id FROM records ORDER BY id DESC LIMIT 1;')
-        return self.cursor.fetchone()[0]
+        return self.read('SELECT id FROM records ORDER BY id DESC LIMIT 1;')[0][0]
 
     '''
     Creates an entry in records and games tables, returns the id of the game for individual stats
@@ -434,37 +736,119 @@ class R6Tracker():
 
     '''
     Returns a list of booleans for players whose stats should be updated
+    games can be given as the get_total_games result of player_list to skip the request
+    pending maps player ids to match counts which are newer than their last record in DB
     '''
-    def is_save_required(self, player_list):
-        lastgames = [0]*len(player_list)
+    def is_save_required(self, player_list, games=None, pending=None):
         new_save = [False]*len(player_list)
-        # Either has no records
+        # Latest match count of all players in one query, through latest_stats
+        sqcmd = '''SELECT p.id, s.match_played
+                   FROM players p LEFT JOIN latest_stats l ON l.player_id = p.id
+                                  LEFT JOIN stats s ON s.player_id = l.player_id AND s.record_id = l.record_id
+                   WHERE p.id IN ({});'''.format(','.join('?'*len(player_list)))
+        last = {row['id']: row for row in self.read(sqcmd, [player['id'] for player in player_list])}
+        # Or the total games played is greater than previous record
+        if games is None:
+            u = self.u
+            games = u.get_total_games([player['uplay_id'] for player in player_list])
         for i, player in enumerate(player_list):
-            sqcmd = 'SELECT * FROM stats WHERE player_id = {} ORDER BY record_id DESC LIMIT 1;'.format(player[0])
-            self.cursor.execute(sqcmd)
-            lastgame = self.cursor.fetchall()
-            if len(lastgame) == 0:
+            row = last.get(player['id'])
+            lastgame = 0
+            if pending and player['id'] in pending:
+                # A newer record is waiting to be written
+                lastgame = pending[player['id']]
+            # Either has no records
+            elif row is None or row['match_played'] is None:
                 print('No previous game record exists in DB for {}'.format(player['name']))
                 new_save[i] = True
-                lastgames[i] = 0
             else:
-                lastgames[i] = lastgame[0]['match_played']
-            sqcmd = 'SELECT * FROM op_stats WHERE player_id = {};'.format(player[0])
-            self.cursor.execute(sqcmd)
-            lastgame = self.cursor.fetchall()
-            if len(lastgame) == 0:
-                print('No operator stats exists in DB for {}'.format(player['name']))
-                new_save[i] = True
-        # Or the total games played is greater than previous record
-        u = self.u
-        games = u.get_total_games([player['uplay_id'] for player in player_list])
-        for i in range(len(games)):
-            if games[i] - lastgames[i] > 0.5:
-                print('SUCCESS: {} new game(s) have been found for {}'.format(games[i]-lastgames[i], player_list[i]['name']))
+                lastgame = row['match_played']
+            if games[i] - lastgame > 0.5:
+                print('SUCCESS: {} new game(s) have been found for {}'.format(games[i]-lastgame, player['name']))
                 new_save[i] = True
         # If all fails, it means there is no new update
         return new_save
 
+    '''
+    Yields the rows (ordered by player_id and record_id) as dictionaries with the op_stats columns of their record
+    An operator keeps the stats of its last row in operator_stats until it changes
+    '''
+    def with_operator_stats(self, rows, db=None):
+        if db is None:
+            with self.readers.connection() as db:
+                yield from self.with_operator_stats(rows, db)
+            return
+        stats = [s[2] for s in OPERATOR_STAT_LIST]
+        columns = [o[2] for o in OPERATOR_COLUMN_LIST]
+        current = None
+        for row in rows:
+            if row['player_id'] != current:
+                current = row['player_id']
+                values = dict.fromkeys(columns, 0)
+                ops = db.execute('SELECT * FROM operator_stats WHERE player_id = ? ORDER BY record_id;', (current,))
+                op = ops.fetchone()
+            while op is not None and op['record_id'] <= row['record_id']:
+                for s in stats:
+                    values[op['operator'] + '_' + s] = op[s]
+                op = ops.fetchone()
+            wide = dict(row)
+            wide.update(values)
+            yield wide
+
+    '''
+    Returns the last record at or before start_dt followed by the records until end_dt
+    If increment > 0, only the last record of every `increment` days long bucket is returned with its d_from and d_to dates
+    If the buckets start at midnight, they are built from the rollups table instead of all records
+    columns are selected from the joined players, records and `tables` rows of the player, `tables` should include stats
+    '''
+    def progress_records(self, name, columns, tables, start_dt, end_dt, increment=0, rollups=False):
+        joins = ' AND '.join(snapshot_join(t) for t in tables)
+        params = {'name': name, 'st': start_dt, 'et': end_dt, 'inc': increment}
+        sqcmd = '''SELECT {dates}dt, {columns}
+                   FROM players, records, {tables}
+                   WHERE players.name=:name AND {joins} AND records.dt <= :st ORDER BY records.id DESC LIMIT 1;
+                '''.format(dates='NULL as d_from, NULL as d_to, ' if increment > 0 else '', columns=columns, tables=', '.join(tables), joins=joins)
+        records = self.read(sqcmd, params)
+        raw = '''SELECT records.dt as dt, {columns}
+                 FROM players, records, {tables}
+                 WHERE players.name=:name AND {joins} AND records.dt BETWEEN {{lo}} AND :et
+              '''.format(columns=columns, tables=', '.join(tables), joins=joins)
+        if increment == 0:
+            sqcmd = raw.format(lo=':st') + ' ORDER BY records.dt;'
+            # A record exactly at start_dt is already the first one
+            return records + [r for r in self.read(sqcmd, params) if not records or r['dt'] != records[0]['dt']]
+        period = None
+        if rollups:
+            start = datetime.date.fromisoformat(start_dt[:10])
+            if 'week' in ROLLUP_PERIODS and increment % 7 == 0 and start.weekday() == 0:
+                period = 'week'
+            elif 'day' in ROLLUP_PERIODS:
+                period = 'day'
+        if period is None:
+            source = raw.format(lo=':st')
+        else:
+            # Completed days (or weeks) come from their last records, the current one from all of its records
+            params['period'] = period
+            params['tail'] = dict(rollup_buckets(datetime.datetime.fromisoformat(end_dt[:10])))[period]
+            params['lo'] = max(start_dt, params['tail'])
+            source = '''SELECT records.dt as dt, {columns}
+                        FROM players, rollups, records, {tables}
+                        WHERE players.name=:name AND rollups.player_id=players.id AND rollups.period=:period AND
+                              rollups.bucket >= date(:st) AND rollups.bucket < :tail AND records.id=rollups.record_id AND {joins}
+                        UNION ALL
+                     '''.format(columns=columns, tables=', '.join(tables), joins=joins) + raw.format(lo=':lo')
+        # Numbers the records of every bucket from the latest one, the buckets are not limited in number
+        bucket = 'CAST((julianday(dt) - julianday(:st)) / :inc AS INTEGER)'
+        sqcmd = '''SELECT * FROM (
+                       SELECT date(:st, '+' || ({bucket} * :inc) || ' days') as d_from,
+                              date(:st, '+' || (({bucket} + 1) * :inc) || ' days') as d_to,
+                              *,
+                              ROW_NUMBER() OVER (PARTITION BY {bucket} ORDER BY dt DESC) as rn
+                       FROM ({source}))
+                   WHERE rn = 1 ORDER BY dt;
+                '''.format(bucket=bucket, source=source)
+        return records + self.read(sqcmd, params)
+
     '''
     Returns the progress info for user
 
@@ -489,7 +873,7 @@ class R6Tracker():
     '''
     def get_player_progress(self, name, start_dt=None, end_dt=None, summary_type='Increment', increment=0, stype='Ranked', printStats=True, cutoff='00:00'):
         if start_dt is None:
-            start_dt = self.custom_query('SELECT dt FROM records ORDER BY dt ASC LIMIT 1;')[0]['dt']
+            start_dt = self.read('SELECT dt FROM records ORDER BY dt ASC LIMIT 1;')[0]['dt']
         if end_dt is None:
             end_dt = str(datetime.datetime.now())
         if increment > 0:
@@ -498,57 +882,7 @@ class R6Tracker():
         if stype == 'Ranked':
             ranked_stats = [2,3,4,5,10,11]
             
-            if increment==0:
-                # Get all stats first
-                sqcmd = '''
-                SELECT *
-                FROM(
-                SELECT dt, casual_won, casual_lost, {ranked}, {ranks} 
-                FROM players, records, stats 
-                WHERE players.name="{name}" AND players.id=stats.player_id AND records.id=stats.record_id AND records.dt <= "{st}" ORDER BY stats.record_id DESC LIMIT 1
-                )
-                UNION
-                SELECT *
-                FROM(
-                SELECT dt, casual_won, casual_lost, {ranked}, {ranks} 
-                FROM players, records, stats 
-                WHERE players.name="{name}" AND players.id=stats.player_id AND records.id=stats.record_id AND records.dt BETWEEN "{st}" AND "{et}"
-                );
-                '''.format(ranked=', '.join([STAT_LIST[i][1] for i in ranked_stats]), ranks=', '.join([i[1] for i in PROGRESS_LIST]), name=name, st=start_dt, et=end_dt)
-            else:
-                sqcmd = '''
-                SELECT NULL as d_from, NULL as d_to, *
-                FROM(
-                SELECT dt, casual_won, casual_lost, {ranked}, {ranks} 
-                FROM players, records, stats 
-                WHERE players.name="{name}" AND players.id=stats.player_id AND records.id=stats.record_id AND records.dt <= "{st}" ORDER BY stats.record_id DESC LIMIT 1
-                )
-                '''
-
-                start = 0
-                daydiff = self.time_diff(start_dt, end_dt) #datetime.datetime.strptime(start_dt, '%Y-%m-%d %H:%M:%S') - datetime.datetime.strptime(end_dt, '%Y-%m-%d %H:%M:%S')
-                if (daydiff.days / increment) >= 450:
-                    print('INFO: Too many days are in DB, displaying last 500 days...')
-                    start = max(0, int(daydiff.days/increment)+1-450)
-
-                for inc in range(start, daydiff.days+1, increment):
-                    dailyunion = '''
-                    UNION
-                    SELECT date("{{st}}", '+{inc} days') as d_from, date("{{st}}", '+{inc1} days') as d_to, *  FROM(
-                        SELECT dt, casual_won, casual_lost, {{ranked}}, {{ranks}}
-                        FROM players, records, stats 
-                        WHERE players.name="{{name}}" AND players.id=stats.player_id AND records.id=stats.record_id AND dt BETWEEN datetime("{{st}}", '+{inc} days') AND datetime("{{st}}", '+{inc1} days') ORDER BY records.dt DESC LIMIT 1
-                    )
-                    '''.format(inc = inc, inc1 = inc+increment)
-                    sqcmd += dailyunion
-                # Calculate day diff
-
-                sqcmd = sqcmd.format(ranked=', '.join([STAT_LIST[i][1] for i in ranked_stats]), ranks=', '.join([i[1] for i in PROGRESS_LIST]), name=name, st=start_dt, et=end_dt)
-                # For loop for increment
-                
-                
-            self.cursor.execute(sqcmd)
-            allrecords = self.cursor.fetchall()
+            allrecords = self.progress_records(name, 'casual_won, casual_lost, {}, {}'.format(', '.join([STAT_LIST[i][1] for i in ranked_stats]), ', '.join([i[1] for i in PROGRESS_LIST])), ['stats'], start_dt, end_dt, increment, cutoff == '00:00')
             
             if allrecords is None or len(allrecords) <= 1:
                 print('WARNING: (Ranked stats) No game records between requested date-times.')
@@ -711,52 +1045,7 @@ class R6Tracker():
             
             casual_stats = [6,7,8,9,10,11]
 
-            if increment==0:
-                # Get all stats first
-                sqcmd = '''
-                SELECT *
-                FROM(
-                SELECT dt, ranked_won, ranked_lost, {casual}, {ranks} 
-                FROM players, records, stats 
-                WHERE players.name="{name}" AND players.id=stats.player_id AND records.id=stats.record_id AND records.dt <= "{st}" ORDER BY stats.record_id DESC LIMIT 1
-                )
-                UNION
-                SELECT *
-                FROM(
-                SELECT dt, ranked_won, ranked_lost, {casual}, {ranks} 
-                FROM players, records, stats 
-                WHERE players.name="{name}" AND players.id=stats.player_id AND records.id=stats.record_id AND records.dt BETWEEN "{st}" AND "{et}"
-                );
-                '''.format(casual=', '.join([STAT_LIST[i][1] for i in casual_stats]), ranks=', '.join([i[1] for i in PROGRESS_LIST]), name=name, st=start_dt, et=end_dt)
-            else:
-                sqcmd = '''
-                SELECT NULL as d_from, NULL as d_to, *
-                FROM(
-                SELECT dt, ranked_won, ranked_lost, {casual}, {ranks} 
-                FROM players, records, stats 
-                WHERE players.name="{name}" AND players.id=stats.player_id AND records.id=stats.record_id AND records.dt <= "{st}" ORDER BY stats.record_id DESC LIMIT 1
-                )
-                '''
-                
-                daydiff = self.time_diff(start_dt, end_dt) #datetime.datetime.strptime(start_dt, '%Y-%m-%d %H:%M:%S') - datetime.datetime.strptime(end_dt, '%Y-%m-%d %H:%M:%S')
-                for inc in range(0, daydiff.days+1, increment):
-                    dailyunion = '''
-                    UNION
-                    SELECT date("{{st}}", '+{inc} days') as d_from, date("{{st}}", '+{inc1} days') as d_to, *  FROM(
-                        SELECT dt, ranked_won, ranked_lost, {{casual}}, {{ranks}}
-                        FROM players, records, stats 
-                        WHERE players.name="{{name}}" AND players.id=stats.player_id AND records.id=stats.record_id AND dt BETWEEN datetime("{{st}}", '+{inc} days') AND datetime("{{st}}", '+{inc1} days') ORDER BY records.dt DESC LIMIT 1
-                    )
-                    '''.format(inc = inc, inc1 = inc+increment)
-                    sqcmd += dailyunion
-                # Calculate day diff
-
-                sqcmd = sqcmd.format(casual=', '.join([STAT_LIST[i][1] for i in casual_stats]), ranks=', '.join([i[1] for i in PROGRESS_LIST]), name=name, st=start_dt, et=end_dt)
-                # For loop for increment
-                
-                
-            self.cursor.execute(sqcmd)
-            allrecords = self.cursor.fetchall()
+            allrecords = self.progress_records(name, 'ranked_won, ranked_lost, {}, {}'.format(', '.join([STAT_LIST[i][1] for i in casual_stats]), ', '.join([i[1] for i in PROGRESS_LIST])), ['stats'], start_dt, end_dt, increment, cutoff == '00:00')
             
             if allrecords is None or len(allrecords) <= 1:
                 print('WARNING: (Casual stats) No game records between requested date-times.')
@@ -899,67 +1188,7 @@ class R6Tracker():
             
         if stype == 'Gun':
             
-            if increment==0:
-                sqcmd = '''
-                SELECT *
-                FROM(
-                SELECT dt, gun_stats.*, stats.ranked_won, stats.ranked_lost, stats.casual_won, stats.casual_lost
-                FROM players, records, gun_stats, stats
-                WHERE players.name="{name}" AND 
-                      players.id=gun_stats.player_id AND
-                      records.id=gun_stats.record_id AND 
-                      players.id=stats.player_id AND
-                      records.id=stats.record_id AND
-                      records.dt <= "{st}" ORDER BY records.id DESC LIMIT 1
-                )
-                UNION
-                SELECT *
-                FROM(
-                SELECT dt, gun_stats.*, stats.ranked_won, stats.ranked_lost, stats.casual_won, stats.casual_lost
-                FROM players, records, gun_stats, stats
-                WHERE players.name="{name}" AND 
-                      players.id=gun_stats.player_id AND
-                      records.id=gun_stats.record_id AND 
-                      players.id=stats.player_id AND
-                      records.id=stats.record_id AND
-                      records.dt BETWEEN "{st}" AND "{et}"
-                );
-                '''.format(name=name, st=start_dt, et=end_dt)
-            else:
-                sqcmd = '''
-                SELECT NULL as d_from, NULL as d_to, *
-                FROM(
-                SELECT dt, gun_stats.*, stats.ranked_won, stats.ranked_lost, stats.casual_won, stats.casual_lost
-                FROM players, records, gun_stats, stats
-                WHERE players.name="{name}" AND 
-                      players.id=gun_stats.player_id AND
-                      records.id=gun_stats.record_id AND 
-                      players.id=stats.player_id AND
-                      records.id=stats.record_id AND
-                      records.dt <= "{st}" ORDER BY records.id DESC LIMIT 1
-                )
-                '''
-                
-                daydiff = self.time_diff(start_dt, end_dt)
-                for inc in range(0, daydiff.days+1, increment):
-                    dailyunion = '''
-                    UNION
-                    SELECT date("{{st}}", '+{inc} days') as d_from, date("{{st}}", '+{inc1} days') as d_to, *  FROM(
-                        SELECT dt, gun_stats.*, stats.ranked_won, stats.ranked_lost, stats.casual_won, stats.casual_lost
-                        FROM players, records, gun_stats, stats
-                        WHERE players.name="{{name}}" AND
-                              players.id=gun_stats.player_id AND
-                              records.id=gun_stats.record_id AND
-                              players.id=stats.player_id AND
-                              records.id=stats.record_id AND
-                              dt BETWEEN datetime("{{st}}", '+{inc} days') AND datetime("{{st}}", '+{inc1} days') ORDER BY records.dt DESC LIMIT 1
-                    )
-                    '''.format(inc = inc, inc1 = inc+increment)
-                    sqcmd += dailyunion
-                sqcmd = sqcmd.format(name=name, st=start_dt, et=end_dt)
-
-            self.cursor.execute(sqcmd)
-            allrecords = self.cursor.fetchall()
+            allrecords = self.progress_records(name, snapshot_columns('gun_stats') + ', stats.ranked_won, stats.ranked_lost, stats.casual_won, stats.casual_lost', ['gun_stats', 'stats'], start_dt, end_dt, increment, cutoff == '00:00')
 
             if allrecords is None or len(allrecords) == 0:
                 print('WARNING: (Gun stats) No game records between requested date-times.')
@@ -1059,67 +1288,9 @@ class R6Tracker():
                 return gun_table
 
         if stype == 'Operator':
-            if increment==0:
-                sqcmd = '''
-                SELECT *
-                FROM(
-                SELECT dt, op_stats.*, stats.ranked_won, stats.ranked_lost, stats.casual_won, stats.casual_lost
-                FROM players, records, op_stats, stats
-                WHERE players.name="{name}" AND 
-                      players.id=op_stats.player_id AND
-                      records.id=op_stats.record_id AND 
-                      players.id=stats.player_id AND
-                      records.id=stats.record_id AND
-                      records.dt <= "{st}" ORDER BY records.id DESC LIMIT 1
-                )
-                UNION
-                SELECT *
-                FROM(
-                SELECT dt, op_stats.*, stats.ranked_won, stats.ranked_lost, stats.casual_won, stats.casual_lost
-                FROM players, records, op_stats, stats
-                WHERE players.name="{name}" AND 
-                      players.id=op_stats.player_id AND
-                      records.id=op_stats.record_id AND 
-                      players.id=stats.player_id AND
-                      records.id=stats.record_id AND
-                      records.dt BETWEEN "{st}" AND "{et}"
-                );
-                '''.format(name=name, st=start_dt, et=end_dt)
-            else:
-                sqcmd = '''
-                SELECT NULL as d_from, NULL as d_to, *
-                FROM(
-                SELECT dt, op_stats.*, stats.ranked_won, stats.ranked_lost, stats.casual_won, stats.casual_lost
-                FROM players, records, op_stats, stats
-                WHERE players.name="{name}" AND 
-                      players.id=op_stats.player_id AND
-                      records.id=op_stats.record_id AND 
-                      players.id=stats.player_id AND
-                      records.id=stats.record_id AND
-                      records.dt <= "{st}" ORDER BY records.id DESC LIMIT 1
-                )
-                '''
-                
-                daydiff = self.time_diff(start_dt, end_dt)
-                for inc in range(0, daydiff.days+1, increment):
-                    dailyunion = '''
-                    UNION
-                    SELECT date("{{st}}", '+{inc} days') as d_from, date("{{st}}", '+{inc1} days') as d_to, *  FROM(
-                        SELECT dt, op_stats.*, stats.ranked_won, stats.ranked_lost, stats.casual_won, stats.casual_lost
-                        FROM players, records, op_stats, stats
-                        WHERE players.name="{{name}}" AND
-                              players.id=op_stats.player_id AND
-                              records.id=op_stats.record_id AND
-                              players.id=stats.player_id AND
-                              records.id=stats.record_id AND
-                              dt BETWEEN datetime("{{st}}", '+{inc} days') AND datetime("{{st}}", '+{inc1} days') ORDER BY records.dt DESC LIMIT 1
-                    )
-                    '''.format(inc = inc, inc1 = inc+increment)
-                    sqcmd += dailyunion
-                sqcmd = sqcmd.format(name=name, st=start_dt, et=end_dt)
-            
-            self.cursor.execute(sqcmd)
-            allrecords = self.cursor.fetchall()
+            allrecords = self.progress_records(name, 'stats.player_id, stats.record_id, stats.ranked_won, stats.ranked_lost, stats.casual_won, stats.casual_lost', ['stats'], start_dt, end_dt, increment, cutoff == '00:00')
+            if allrecords:
+                allrecords = list(self.with_operator_stats(allrecords))
 
             if allrecords is None or len(allrecords) == 0:
                 print('WARNING: (Operator Stats) No game records between requested date-times.')
@@ -1247,29 +1418,26 @@ class R6Tracker():
     '''
     def get_players(self, names):
         u = self.u
-        self.cursor.execute('SELECT * FROM players WHERE name IN ({});'.format(','.join(['"' + str(name) + '"' for name in names])))
-        return self.cursor.fetchall()
+        return self.read('SELECT * FROM players WHERE name IN ({});'.format(','.join('?'*len(names))), names)
 
     '''
     Returns a list of all players in the database
     '''
     def get_all_players(self):
         u = self.u
-        self.cursor.execute('SELECT * FROM players;')
-        return self.cursor.fetchall()
+        return self.read('SELECT * FROM players;')
 
     '''
     Returns a list of last records of all players in database
     '''
     def get_last_records(self):
         sqcmd = '''SELECT players.id, players.name, stats.*
-            FROM players, stats
+            FROM players, latest_stats, stats
             WHERE
-                stats.record_id = (SELECT MAX(record_id) FROM stats as s2 WHERE s2.player_id = players.id) AND players.id = stats.player_id
+                latest_stats.player_id = players.id AND stats.player_id = players.id AND stats.record_id = latest_stats.record_id
             ORDER BY stats.skill_mean DESC
         '''
-        self.cursor.execute(sqcmd)
-        allplayers = self.cursor.fetchall()
+        allplayers = self.read(sqcmd)
         comp_table = [['Player', '# Games', 'Total Time Played', 'K', 'D', 'K/D', 'HS', 'HPK', 'W', 'L', 'W/L', 'Rank', 'Max Rank', 'MMR',  'Max MMR', 'Skill', 'Skill Std']]
         
         for p in allplayers:
@@ -1308,6 +1476,8 @@ class R6Tracker():
         region = 'ncsa'
         for i in REGIONS:
             r_dict = self.u.get_rank(id, i[1])
+            if r_dict is None:
+                continue
             region_games = r_dict['wins'] + r_dict['losses']
             if region_games > max_games:
                 region = i[1]
@@ -1322,12 +1492,10 @@ class R6Tracker():
         players = self.get_all_players()
         for player in players:
             sqcmd = 'SELECT * FROM seasons WHERE seasons.player_id = {} ORDER BY season DESC'.format(player['id'])
-            self.cursor.execute(sqcmd)
-            seasons = self.cursor.fetchall()
+            seasons = self.read(sqcmd)
             if len(seasons) == 0:
                 self.save_season_stats()
-                self.cursor.execute(sqcmd)
-                seasons = self.cursor.fetchall()
+                seasons = self.read(sqcmd)
             player_table = [['Season Name', 'Season', 'W', 'L', 'W/L', 'Last Rank', 'MMR', 'Max Rank', 'Max MMR', 'Skill', 'Skill-Low', 'Skill-High']]
             for s in seasons:
                 if s['season_wins'] + s['season_losses'] <= 0.5:
@@ -1367,31 +1535,75 @@ class R6Tracker():
             try:
                 if newname != oldname:
                     change = True
-                    sqcmd = '''UPDATE players SET name = '{}' WHERE uplay_id = '{}';'''.format(newname, player['uplay_id'])
                     print('Changing names: {} -> {}'.format(oldname, newname))
-                    self.cursor.execute(sqcmd)
+                    self.cursor.execute('UPDATE players SET name = ? WHERE uplay_id = ?;', (newname, player['uplay_id']))
+                    # Keep the old name so lookups by it still resolve without the API
+                    self.cursor.execute('INSERT OR REPLACE INTO aliases (name, uplay_id, last_seen) VALUES (?,?,?);',
+                                        (oldname, player['uplay_id'], str(datetime.datetime.now())))
                     self.db.commit()
             except Exception as e:
                 print('An error occured: {}'.format(e))
         return change
 
     def get_db_version(self):
-        self.cursor.execute('SELECT * FROM dbinfo WHERE tag="version"')
-        res = self.cursor.fetchone()
-        return res['value']
+        return self.read('SELECT * FROM dbinfo WHERE tag="version"')[0]['value']
+
+    '''
+    Saves season stats like save_season_stats, requests for all players and seasons are sent concurrently
+    Usage: asyncio.run(tracker.async_save_season_stats())
+    '''
+    async def async_save_season_stats(self):
+        au = self.get_async_connection()
+        players = self.get_all_players()
+        regions = group_by_region(players)
+        # Any player of a region tells the current season
+        region, ids = next(iter(regions.items()))
+        res = next(iter((await au.get_ranks(ids, region=region)).values()), None)
+        if res is None:
+            print('ERROR: Cannot get the current season.')
+            return
+        current_season = res['season']
+        jobs = [(region, season) for region in regions for season in range(1, current_season+1)]
+        print('Getting season stats of {} players ({} requests)'.format(len(players), len(jobs)))
+        results = await asyncio.gather(*[au.get_ranks(regions[region], region=region, season=season) for region, season in jobs])
+        season_ranks = {}
+        for (region, season), r_dict in zip(jobs, results):
+            season_ranks.setdefault(season, {}).update(r_dict)
+        cols = ', '.join(p[1] for p in PROGRESS_LIST)
+        for player in players:
+            for season in range(1, current_season+1):
+                ps = season_ranks[season].get(player['uplay_id'])
+                if ps is None:
+                    print('WARNING: No season {} stats for {}, skipped.'.format(season, player['name']))
+                    continue
+                vals = '{}, {}, '.format(player['id'], season) + ', '.join(str(ps[p[0]]) for p in PROGRESS_LIST)
+                sqcmd = 'INSERT OR REPLACE INTO seasons (player_id, season, {cols}) VALUES ({vals});'.format(cols=cols, vals=vals)
+                self.cursor.execute(sqcmd)
+        self.db.commit()
 
     def save_season_stats(self):
         players = self.get_all_players()
         #print('WARNING: Ubi has a problem listing seasons before Velvet Shell (5)')
         # Get current season stats to find out max number of seasons to be pulled
-        res = self.u.get_rank(id=players[0]['uplay_id'], region=players[0]['region'])
+        regions = group_by_region(players)
+        # Any player of a region tells the current season
+        region, ids = next(iter(regions.items()))
+        res = next(iter(self.u.get_ranks(ids, region=region).values()), None)
+        if res is None:
+            print('ERROR: Cannot get the current season.')
+            return
         current_season = res['season']
-        np = len(players)
-        for pno, player in enumerate(players):
-            print('Getting season stats of {} ({}/{})'.format(player['name'], pno+1, np))
-            for season in range(1,current_season+1):
-                ps = self.u.get_rank(id=player['uplay_id'], region=player['region'], season=season)
-                cols = ', '.join(p[1] for p in PROGRESS_LIST)
+        cols = ', '.join(p[1] for p in PROGRESS_LIST)
+        for season in range(1,current_season+1):
+            print('Getting season stats of {} players ({}/{})'.format(len(players), season, current_season))
+            season_ranks = {}
+            for region, ids in regions.items():
+                season_ranks.update(self.u.get_ranks(ids, region=region, season=season))
+            for player in players:
+                ps = season_ranks.get(player['uplay_id'])
+                if ps is None:
+                    print('WARNING: No season {} stats for {}, skipped.'.format(season, player['name']))
+                    continue
                 vals = '{}, {}, '.format(player['id'], season) + ', '.join(str(ps[p[0]]) for p in PROGRESS_LIST)
                 sqcmd = 'INSERT OR REPLACE INTO seasons (player_id, season, {cols}) VALUES ({vals});'.format(cols=cols, vals=vals)
                 self.cursor.execute(sqcmd)
@@ -1401,11 +1613,10 @@ class R6Tracker():
     Prints all table contents to console
     '''
     def print_all_db(self):
-        tables = ['dbinfo', 'players', 'records', 'stats', 'seasons', 'op_stats', 'gun_stats']
+        tables = ['dbinfo', 'players', 'records', 'stats', 'seasons', 'operator_stats', 'gun_stats']
         for t in tables:
             print(t)
-            self.cursor.execute('SELECT * FROM {};'.format(t))
-            rows = self.cursor.fetchall()
+            rows = self.read('SELECT * FROM {};'.format(t))
             for row in rows:
                 print(list(row))
 
@@ -1417,24 +1628,32 @@ class R6Tracker():
             teams = [1] * len(players)
         ptable = [['Player', 'Team', 'MMR', 'Std', 'Rank', 'Season-W', 'Season-L', 'Atk', 'WL', 'KD', 'Def', 'WL', 'KD']]
         tsums = []
+        # Resolve all names and request ranks and operators at once
+        try:
+            uids = self.resolve_names(players)
+        except:
+            uids = {}
+        found = [uids[p] for p in players if uids.get(p) is not None]
+        ranks = self.u.get_ranks(found) if found else {}
+        all_ops = dict(zip(found, self.u.get_operator_stats(ids=found))) if found and op_stats else {}
         for team in [1, 2]:
             team_total = 0
             for i in range(len(players)):
                 if teams[i] == team:
-                    try:
-                        uid = self.u.get_player_by_name(players[i])
-                        if uid is None:
-                            continue
-                    except:
+                    uid = uids.get(players[i])
+                    if uid is None:
+                        continue
+                    res = ranks.get(uid)
+                    if res is None:
+                        print('WARNING: No rank data for {}, skipped.'.format(players[i]))
                         continue
-                    res = self.u.get_rank(id=uid)
                     mmr = res['mmr']
                     std = res['skill_stdev']
                     rank = EMBER_RISE_NEW_RANKS[int(res['rank'])][0]
                     wins = res['wins']
                     losses = res['losses']
                     if op_stats:
-                        ops = self.u.get_operator_stats(ids=[uid])
+                        ops = [all_ops[uid]]
                         #import pprint
                         #pprint.pprint(ops)
                         # Attackers
@@ -1480,146 +1699,201 @@ class R6Tracker():
         pretty_print(ptable + tsums)
 
     '''
-    Prints all logs to csv files (daily.csv and pings.csv)
+    Writes the stats of all records to a csv file, gzip compressed if compress is True or filename ends with .gz
+    Rows are streamed from the database in batches of batch_size, verbose prints the progress
     '''
-    def export_to_csv(self, filename='export.csv', verbose=True):
-        if verbose:
-            print('CSV data:')
+    def export_to_csv(self, filename='export.csv', verbose=True, compress=None, batch_size=EXPORT_BATCH_SIZE):
         sqcmd = '''SELECT players.name,
                           records.dt,
                           stats.*,
-                          gun_stats.*,
-                          op_stats.*
+                          {}
                    FROM   players, 
                           records,
                           stats,
-                          op_stats,
                           gun_stats
-                   WHERE players.id = stats.player_id AND records.id = stats.record_id AND 
-                         players.id = gun_stats.player_id AND records.id = gun_stats.record_id AND
-                         players.id = op_stats.player_id AND records.id = op_stats.record_id;
-                '''
-        self.cursor.execute(sqcmd)
-        rows = self.cursor.fetchall()
-        csvdata = [','.join(d[0] for d in self.cursor.description)]
-        for row in rows:
-            csvdata.append(','.join([str(i) for i in list(row)]))
-        csvfile = open(filename, 'w')
-        for r in csvdata:
-            csvfile.write(r + '\n')
-            if verbose:
-                print(r)
+                   WHERE players.id = stats.player_id AND records.id = stats.record_id AND {}
+                   ORDER BY stats.player_id, stats.record_id;
+                '''.format(snapshot_columns('gun_stats'), snapshot_join('gun_stats'))
+        if compress is None:
+            compress = filename.endswith('.gz')
+        csvfile = gzip.open(filename, 'wt', newline='') if compress else open(filename, 'w', newline='')
+        with self.readers.connection() as db:
+            total = db.execute('SELECT COUNT(*) FROM stats;').fetchone()[0]
+            cursor = db.execute(sqcmd)
+            writer = csv.writer(csvfile)
+            writer.writerow([d[0] for d in cursor.description] + [o[2] for o in OPERATOR_COLUMN_LIST])
+            rows = itertools.chain.from_iterable(iter(lambda: cursor.fetchmany(batch_size), []))
+            # Operator stats are rebuilt in the op_stats layout, after the other columns
+            rows, op_rows = itertools.tee(rows)
+            count = 0
+            for row, wide in zip(rows, self.with_operator_stats(op_rows, db)):
+                writer.writerow(list(row) + [wide[o[2]] for o in OPERATOR_COLUMN_LIST])
+                count += 1
+                if verbose and count % batch_size == 0:
+                    print('Exported {}/{} rows'.format(count, total))
         csvfile.close()
+        if verbose:
+            print('Exported {} rows to {}'.format(count, filename))
+        return count
 
     '''
-    Imports other records from an existing db file
+    Imports other records from an existing db file, both files should have the same DB version
+    Players are matched by uplay_id and the records of both files are renumbered by date, in a single transaction
     '''
     def import_from_db(self, fileaddress):
-        print('NOT IMPLEMENTED')
-        return None
-        # Step 1 - Check version, if version mismatch, update it
-        newdb = sqlite3.connect(fileaddress, check_same_thread=False)
-        newdb.row_factory = sqlite3.Row
-        newcursor = newdb.cursor()
-        
-        # Step 1b - Create a copy of db file named (rainbow_backup.db)
-        self.export_to_db('rainbow_backup.db')
-        
-        if True:
-            # Attach DB
-            self.cursor.execute('ATTACH DATABASE "{}" as imported'.format(fileaddress))
-            self.db.commit()
-            
-            # Step 1c - Clean empty ids from stats, op_stats, gun_stats for BOTH tables
-            print('''
-                DELETE FROM imported.stats i
-                WHERE NOT EXISTS (SELECT i.player_id FROM imported.players p WHERE p.id=i.player_id);
-            ''')
-            
-            self.cursor.execute('''
-                DELETE FROM imported.stats i
-                WHERE NOT EXISTS (SELECT i.player_id FROM imported.players p WHERE p.id=i.player_id);
-            ''')
-            
-            
-            # Step 2 - Add players to players table one by one, keep both old and new ID numbers
-            
-            self.cursor.execute('''INSERT INTO players
-                SELECT NULL, np.name, np.uplay_id, np.region
-                FROM imported.players np
-                WHERE NOT EXISTS(SELECT * FROM players op WHERE op.uplay_id=np.uplay_id);
-                ''')
-            self.cursor.execute('''
-                CREATE TABLE _playerfix AS
-                SELECT i.id as imported_id, c.id as current_id
-                FROM imported.players i, players c
-                WHERE i.uplay_id = c.uplay_id;
-                ''')
-            self.db.commit()
-            
-            # Step 3 - Replace player_id numbers in gun_stats, op_stats, stats
-            self.cursor.execute('''
-                UPDATE imported.stats
-                SET player_id=c.current_id
-                FROM _playerfix as c
-                WHERE player_id=c.imported_id
-                ''')
-            self.db.execute()
-            
-            # Step 4 - Find where each record would fit after merge, find ID numbers
-            
-            # Step 4a - Replace all existing record_ids with new ones starting with largest entries
-            
-            # Step 4b - Replace all new record_ids with new ones starting with largest entries in gun_stats, op_stats, new_stats
-            
-            # Step 4c - Add all records to records table one by one, keep both old and new ID numbers
-            
-            # Step 5 - Replace record_id in gun_stats, op_stats, stats
-            
-            # Step 6 - Add all entries in stats file to stats
-            
-            # Step 7 - Add all entries in gun_stats to gun_stats
-            
-            # Step 8 - Add all entries in op_stats to op_stats
-            
-            # Step 9 - Sort stats, gun_stats, op_stats by record_id ASC and player_id ASC
-            
-            # Completed!
-        
-        #except Exception as e:
-        #    # If something goes wrong, replace current file with rainbow_backup
-        #    print('An error has occured, reinstating using backup file.', e)
-        
+        if not os.path.isfile(fileaddress):
+            print('ERROR: {} does not exist'.format(fileaddress))
+            return False
+        self.cursor.execute('ATTACH DATABASE ? AS imported;', (fileaddress,))
+        try:
+            # Step 1 - Check version
+            self.cursor.execute('SELECT value FROM imported.dbinfo WHERE tag="version";')
+            res = self.cursor.fetchone()
+            if res is None or int(res['value']) != DB_VERSION:
+                print('ERROR: DB version of {} is {}, it should be {}. Update it first: in a directory holding it as rainbow.db, run R6Tracker(None).install().'.format(
+                    fileaddress, None if res is None else res['value'], DB_VERSION))
+                return False
+            self.cursor.execute('BEGIN;')
+            try:
+                self.merge_imported()
+                self.db.commit()
+            except Exception as e:
+                # Nothing is written if something goes wrong
+                self.db.rollback()
+                print('ERROR: Could not import {}: {}'.format(fileaddress, e))
+                return False
+        finally:
+            self.cursor.execute('DETACH DATABASE imported;')
+        print('Imported {}'.format(fileaddress))
         return True
-        
 
     '''
-    Copies the db into another db file
+    Merges the tables of the attached database "imported" into the main database, the caller handles the transaction
+    '''
+    def merge_imported(self):
+        # Step 2 - Add new players, map the imported player ids by uplay_id
+        self.cursor.execute('''INSERT INTO main.players (name, uplay_id, region)
+                               SELECT name, uplay_id, region FROM imported.players
+                               WHERE uplay_id NOT IN (SELECT uplay_id FROM main.players);''')
+        self.cursor.execute('''CREATE TEMP TABLE _player_map AS
+                               SELECT i.id AS old_id, p.id AS new_id FROM imported.players i, main.players p
+                               WHERE p.uplay_id = i.uplay_id;''')
+        self.cursor.execute('CREATE UNIQUE INDEX temp._player_map_old ON _player_map(old_id);')
+
+        # Step 3 - Number the records of both files by date, records taken at the same time become one
+        self.cursor.execute('''CREATE TEMP TABLE _record_map AS
+                               SELECT src, old_id, dt, DENSE_RANK() OVER (ORDER BY dt) AS new_id FROM (
+                                   SELECT 0 AS src, id AS old_id, dt FROM main.records
+                                   UNION ALL
+                                   SELECT 1 AS src, id AS old_id, dt FROM imported.records);''')
+        self.cursor.execute('CREATE UNIQUE INDEX temp._record_map_old ON _record_map(src, old_id);')
+
+        # Step 4 - Rebuild the tables keyed by records with the new ids, existing rows win over imported ones
+        for table in ['records', 'stats', 'operator_stats', 'gun_stats', 'rollups']:
+            self.cursor.execute('SELECT sql FROM main.sqlite_master WHERE type = "table" AND name = ?;', (table,))
+            create = self.cursor.fetchone()[0]
+            self.cursor.execute('PRAGMA main.table_info({});'.format(table))
+            cols = [i[1] for i in self.cursor.fetchall()]
+            self.cursor.execute('ALTER TABLE main.{t} RENAME TO _merge_{t};'.format(t=table))
+            self.cursor.execute(create)
+            if table == 'records':
+                self.cursor.execute('INSERT INTO main.records (id, dt) SELECT DISTINCT new_id, dt FROM _record_map ORDER BY new_id;')
+            else:
+                mapped = ', '.join({'player_id': '_player_id', 'record_id': '_record_id'}.get(c, c) for c in cols)
+                t_cols = ', '.join('t.' + c for c in cols)
+                # The last rollup of a bucket is the one with the latest date
+                self.cursor.execute('''INSERT OR {action} INTO main.{t} ({cols})
+                                       SELECT {mapped} FROM (
+                                           SELECT 0 AS _src, t.player_id AS _player_id, r.new_id AS _record_id, {t_cols}
+                                           FROM _merge_{t} t, _record_map r WHERE r.src = 0 AND r.old_id = t.record_id
+                                           UNION ALL
+                                           SELECT 1 AS _src, p.new_id AS _player_id, r.new_id AS _record_id, {t_cols}
+                                           FROM imported.{t} t, _record_map r, _player_map p
+                                           WHERE r.src = 1 AND r.old_id = t.record_id AND p.old_id = t.player_id)
+                                       ORDER BY {order};'''.format(
+                                        action='REPLACE' if table == 'rollups' else 'IGNORE', t=table, cols=', '.join(cols),
+                                        mapped=mapped, t_cols=t_cols, order='dt' if table == 'rollups' else '_src'))
+            self.cursor.execute('DROP TABLE main._merge_{};'.format(table))
+        self.create_indexes()
+        self.backfill_latest_stats()
+
+        # Step 5 - Games keep their ids, imported games are numbered after them unless the same game is already there
+        game_cols = ['queue', 'map', 'round_wins', 'round_losses', 'attack_wins', 'attack_losses', 'defense_wins', 'defense_losses']
+        self.cursor.execute('UPDATE main.games SET record_id = (SELECT new_id FROM _record_map WHERE src = 0 AND old_id = games.record_id);')
+        self.cursor.execute('SELECT IFNULL(MAX(id), 0) FROM main.games;')
+        offset = self.cursor.fetchone()[0]
+        self.cursor.execute('''INSERT INTO main.games (id, record_id, {cols})
+                               SELECT g.id + ?, r.new_id, {g_cols}
+                               FROM imported.games g LEFT JOIN _record_map r ON r.src = 1 AND r.old_id = g.record_id
+                               WHERE NOT EXISTS (SELECT 1 FROM main.games m WHERE m.record_id IS r.new_id AND {same});'''.format(
+                                cols=', '.join(game_cols), g_cols=', '.join('g.' + c for c in game_cols),
+                                same=' AND '.join('m.{c} IS g.{c}'.format(c=c) for c in game_cols)), (offset,))
+        self.cursor.execute('''INSERT OR IGNORE INTO main.game_players (game_id, player_id, kills, assists, deaths, mmr)
+                               SELECT g.game_id + ?, p.new_id, g.kills, g.assists, g.deaths, g.mmr
+                               FROM imported.game_players g, _player_map p
+                               WHERE p.old_id = g.player_id AND g.game_id + ? IN (SELECT id FROM main.games);''', (offset, offset))
+
+        # Step 6 - Seasons with more games and aliases seen later win
+        cols = ', '.join(p[1] for p in PROGRESS_LIST)
+        self.cursor.execute('''INSERT OR REPLACE INTO main.seasons (player_id, season, {cols})
+                               SELECT p.new_id, i.season, {i_cols} FROM imported.seasons i, _player_map p
+                               WHERE p.old_id = i.player_id AND NOT EXISTS (
+                                   SELECT 1 FROM main.seasons s WHERE s.player_id = p.new_id AND s.season = i.season AND
+                                   s.season_wins + s.season_losses >= i.season_wins + i.season_losses);'''.format(
+                                cols=cols, i_cols=', '.join('i.' + p[1] for p in PROGRESS_LIST)))
+        self.cursor.execute('''INSERT OR REPLACE INTO main.aliases (name, uplay_id, last_seen)
+                               SELECT i.name, i.uplay_id, i.last_seen FROM imported.aliases i
+                               WHERE NOT EXISTS (SELECT 1 FROM main.aliases a WHERE a.name = i.name AND a.last_seen >= i.last_seen);''')
+        self.cursor.execute('DROP TABLE temp._player_map;')
+        self.cursor.execute('DROP TABLE temp._record_map;')
+
+    '''
+    Copies the db into another db file while the tracker keeps saving, the copy is the state when the copy started
+    The online backup API copies `pages` pages at a time, vacuum writes a compacted copy with VACUUM INTO instead
     '''
-    def export_to_db(self, filename='rainbow_copy.db'):
-        copyfile('rainbow.db', filename)
+    def export_to_db(self, filename='rainbow_copy.db', vacuum=False, pages=BACKUP_PAGES, verbose=False):
+        def progress(status, remaining, total):
+            print('Copied {}/{} pages'.format(total - remaining, total))
+        with self.readers.connection() as db:
+            if vacuum:
+                # VACUUM INTO needs a new file
+                if os.path.isfile(filename):
+                    os.remove(filename)
+                db.execute('VACUUM INTO ?;', (filename,))
+            else:
+                target = sqlite3.connect(filename)
+                # A read transaction keeps the same snapshot for all steps of the backup
+                db.execute('BEGIN;')
+                db.execute('SELECT COUNT(*) FROM dbinfo;').fetchone()
+                try:
+                    db.backup(target, pages=pages, progress=progress if verbose else None, sleep=0)
+                finally:
+                    db.rollback()
+                    target.close()
+        if verbose:
+            print('Copied the database to {}'.format(filename))
 
     '''
     Resets rainbow.db file
     '''
     def _reset(self):
         print('Resetting the database...')
+        self.readers.close()
         if self.db:
             self.db.close()
-        if os.path.isfile('rainbow.db'):
-            os.remove('rainbow.db')
+        for f in ['rainbow.db', 'rainbow.db-wal', 'rainbow.db-shm']:
+            if os.path.isfile(f):
+                os.remove(f)
         self.install()
-        self.db = sqlite3.connect('rainbow.db', check_same_thread=False)
-        self.db.row_factory = sqlite3.Row
-        self.cursor = self.db.cursor()
 
     '''
     Returns the requested info of a user
     '''
     def get_user_info(self, name, info):
-        sqcmd = 'SELECT {} FROM stats, players WHERE stats.player_id = players.id AND players.name = "{}" ORDER BY stats.record_id DESC LIMIT 1;'.format(info, name)
-        self.cursor.execute(sqcmd)
-        rows = self.cursor.fetchall()
+        sqcmd = '''SELECT {} FROM players, latest_stats, stats
+                   WHERE players.name = ? AND latest_stats.player_id = players.id AND
+                         stats.player_id = players.id AND stats.record_id = latest_stats.record_id;'''.format(info)
+        rows = self.read(sqcmd, (name,))
         if len(rows) == 0:
             return None
         else:
@@ -1672,6 +1946,44 @@ def pretty_print(table):
         str_row = [str(v) for v in row]
         print(mask.format(*str_row))
 
+'''
+Returns the condition joining the rows of a snapshot table to players and records
+gun_stats rows are only written when they change, a record uses the last row at or before it
+'''
+def snapshot_join(table):
+    if table == 'gun_stats':
+        return '''players.id={t}.player_id AND
+                  {t}.record_id=(SELECT MAX(record_id) FROM {t} AS last WHERE last.player_id=players.id AND last.record_id<=records.id)'''.format(t=table)
+    return 'players.id={t}.player_id AND records.id={t}.record_id'.format(t=table)
+
+'''
+Returns the selected columns of a snapshot table joined by snapshot_join
+The record_id of gun_stats is the joined record, not the older record its values were written with
+'''
+def snapshot_columns(table):
+    if table == 'gun_stats':
+        return ', '.join('records.id AS record_id' if c == 'record_id' else '{}.{}'.format(table, c) for c in GUN_STATS_COLUMNS)
+    return '{}.*'.format(table)
+
+'''
+Returns the (period, bucket) pairs of the rollups table for a record taken at dt
+Weeks are named after their Monday, the season bucket is skipped if the season is not known
+'''
+def rollup_buckets(dt, season=None):
+    buckets = {'day': dt.date().isoformat(),
+               'week': (dt.date() - datetime.timedelta(days=dt.weekday())).isoformat(),
+               'season': None if season is None else str(season)}
+    return [(period, buckets[period]) for period in ROLLUP_PERIODS if buckets[period] is not None]
+
+'''
+Groups players by region, returns a dictionary of region -> list of uplay IDs
+'''
+def group_by_region(players):
+    regions = {}
+    for p in players:
+        regions.setdefault(p['region'], []).append(p['uplay_id'])
+    return regions
+
 def time_to_string(tm):
     m, s = divmod(tm, 60)
     h, m = divmod(m, 60)